@@ -1,15 +1,12 @@
 import streamlit as st
-from openai import OpenAI
 import os
 import shutil
-import PyPDF2
-import pandas as pd
 import json
-import numpy as np
-from zipfile import ZipFile
-import requests
+import time
 import bcrypt
 import base64
+import signal
+import threading
 from styles_and_html import get_page_bg_and_logo_styles
 
 
@@ -18,36 +15,216 @@ if not api_key:
     st.error("API key not found. Please set the OPENAI_API_KEY environment variable.")
     st.stop()
 
-client = OpenAI(api_key=api_key)
-
-# Function to read PDF content
-def read_pdf(file_path):
-    content = ""
-    with open(file_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        for page_num in range(len(reader.pages)):
-            content += reader.pages[page_num].extract_text()
-    return content
-
-# Function to run a GPT task
-def run_gpt_task(instructions, prompt):
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": instructions},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=1
-    )
-    return response.choices[0].message.content
-
-# Load instructions from JSON file
-with open('instructions.json', 'r') as f:
-    instructions = json.load(f)
-
-# Load prompts from JSON file
-with open('prompts.json', 'r') as f:
-    prompts = json.load(f)
+# The pipeline modules pull in pandas, pyarrow, PyPDF2 and httpx, so they are
+# imported on first use after login rather than on the login page.
+# GPT chains run in a background worker process, so a rerun or a page refresh
+# does not interrupt them; one worker is kept per server process
+WORKER_LOG = os.path.join("processed", ".worker.log")
+
+@st.cache_resource
+def get_worker():
+    return {"process": None, "exit": None, "lock": threading.Lock()}
+
+# Function to start the worker, or start it again when it has exited (a crash,
+# an OOM kill, an invalid step_profiles.json) so queued jobs do not wait forever.
+# The exit is kept for show_job.
+def start_worker(api_key, base_url):
+    from jobs import spawn_worker
+
+    worker = get_worker()
+    with worker["lock"]:
+        process = worker["process"]
+        if process is not None and process.poll() is None:
+            return worker
+        if process is not None:
+            worker["exit"] = {"code": process.returncode, "time": time.time()}
+        os.makedirs("processed", exist_ok=True)
+        worker["process"] = spawn_worker(api_key, base_url, log_path=WORKER_LOG)
+    return worker
+
+# Function to describe how the worker last exited, with the end of its log
+def worker_exit_message(exit_state):
+    code = exit_state["code"]
+    if code < 0:
+        how = f"was killed by {signal.Signals(-code).name}"
+    else:
+        how = f"exited with code {code}"
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(exit_state["time"]))
+    message = f"The job worker {how} (noticed at {when}) and has been started again."
+    if os.path.exists(WORKER_LOG):
+        with open(WORKER_LOG, "r", errors="replace") as f:
+            tail = "".join(f.readlines()[-15:]).strip()
+        if tail:
+            message += f"\n\nLast worker output:\n```\n{tail}\n```"
+    return message
+
+@st.cache_resource
+def get_job_queue():
+    from jobs import JobQueue
+    return JobQueue()
+
+# Function to show the latest job of a company's tab: its status, each step's
+# output so far and, once done, the run stats. With `partial_download` the
+# outputs finished so far can be downloaded while it runs. Returns True while it is active.
+def show_job(company_name, tab, success_message, download_label, partial_download=False):
+    from bundles import company_bundle
+    from jobs import ACTIVE
+
+    job_queue = get_job_queue()
+    job = job_queue.latest(company_name, tab)
+    if job is None:
+        return False
+
+    steps = job_queue.steps(job["id"])
+    # The bundles hold only the files this job's finished steps wrote, not older
+    # versions or other uploads' pages; jobs from before steps recorded their
+    # files get the tab's files
+    file_names = None
+    if any(step["output"] for step in steps):
+        file_names = {step["output"] for step in steps if step["output"] and step["status"] in ("done", "reused")}
+    if job["status"] in ACTIVE:
+        # A job stays queued or running while no live worker picks it up
+        exit_state = get_worker()["exit"]
+        if exit_state is not None and exit_state["time"] >= job["created"]:
+            st.warning(worker_exit_message(exit_state))
+        counts = job_queue.counts()
+        st.info(f"Job {job['id']} is {job['status']} ({counts['running']} running, {counts['queued']} queued overall)")
+        if steps:
+            finished = sum(1 for step in steps if step["status"] == "done")
+            st.progress(finished / len(steps), text=f"{finished} of {len(steps)} steps finished")
+        if partial_download:
+            # Rebuilt only when another output has been written
+            bundle = company_bundle(company_name, tab, file_names=file_names)
+            if bundle:
+                file_name, data = bundle
+                st.download_button(f"{download_label} (finished so far)", data, file_name=file_name,
+                                   mime="application/zip", key=f"{tab}_partial_bundle")
+    elif job["status"] == "failed":
+        st.error(f"Job {job['id']} failed: {job['error']}")
+    else:
+        st.success(success_message)
+        # The zip is built in memory when first shown and reused until one of its files changes
+        bundle = company_bundle(company_name, tab, file_names=file_names)
+        if bundle:
+            file_name, data = bundle
+            st.download_button(download_label, data, file_name=file_name, mime="application/zip", key=f"{tab}_bundle")
+
+    for step in steps:
+        with st.expander(f"{step['step'].replace('_', ' ').capitalize()} ({step['status']})"):
+            st.markdown(step["text"])
+
+    result = job["result"] or {}
+    if result.get("reused_steps"):
+        st.caption(f"Reused unchanged steps: {', '.join(result['reused_steps'])}")
+    # Cache figures come from this job's own metrics; the worker's transport is shared by concurrent jobs
+    run_metrics = result.get("metrics")
+    if run_metrics:
+        st.caption(f"Response cache: {run_metrics['cache_hits']} hits, {run_metrics['requests']} misses")
+        if run_metrics["prompt_tokens"]:
+            share = run_metrics["cached_tokens"] / run_metrics["prompt_tokens"]
+            st.caption(f"Provider prompt cache: {run_metrics['cached_tokens']} of {run_metrics['prompt_tokens']} "
+                       f"prompt tokens cached ({share:.0%})")
+        st.caption(f"This run: {run_metrics['requests']} requests, {run_metrics['retries']} retries, "
+                   f"estimated cost ${run_metrics['cost']:.4f}")
+    return job["status"] in ACTIVE
+
+# Function to show a company's recent runs, the per-step breakdown of one of
+# them, a histogram of step latencies and the metrics exports
+def show_metrics(company_name):
+    import pandas as pd
+    from metrics import LATENCY_BUCKETS, MetricsStore, histogram, to_prometheus
+
+    export = MetricsStore().export(company_name, limit=20)
+    runs = export["runs"]
+    if not runs:
+        st.info("No runs recorded for this company yet.")
+        return
+
+    st.dataframe(pd.DataFrame([{
+        "run": run["run_id"],
+        "tab": run["tab"],
+        "status": run["status"],
+        "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["started"])),
+        "seconds": round(run["seconds"], 1),
+        "requests": run["requests"],
+        "retries": run["retries"],
+        "prompt tokens": run["prompt_tokens"],
+        "completion tokens": run["completion_tokens"],
+        "cached tokens": run["cached_tokens"],
+        "cost (USD)": round(run["cost"], 4),
+    } for run in runs]), hide_index=True)
+
+    run_ids = [run["run_id"] for run in runs]
+    run_id = st.selectbox("Show the steps of run", run_ids, key="metrics_run",
+                          format_func=lambda run_id: f"{run_id} ({runs[run_ids.index(run_id)]['tab']})")
+    run = runs[run_ids.index(run_id)]
+    steps = [sample for sample in run["samples"] if sample["kind"] == "step"]
+    if steps:
+        st.dataframe(pd.DataFrame([{
+            "step": sample["name"],
+            "profile": sample["profile"],
+            "status": sample["status"],
+            "seconds": round(sample["seconds"], 2),
+            "queued": round(sample["queue_seconds"], 2),
+            "rate limited": round(sample["wait_seconds"], 2),
+            "requests": sample["requests"],
+            "retries": sample["retries"],
+            "cache hits": sample["cache_hits"],
+            "prompt tokens": sample["prompt_tokens"],
+            "completion tokens": sample["completion_tokens"],
+            "cached tokens": sample["cached_tokens"],
+            "cost (USD)": round(sample["cost"], 4),
+        } for sample in steps]), hide_index=True)
+        # Time spent waiting on rate limits and backoff is part of the step's wall time
+        st.bar_chart(pd.DataFrame({
+            "working": [sample["seconds"] - sample["wait_seconds"] for sample in steps],
+            "rate limited": [sample["wait_seconds"] for sample in steps],
+            "queued": [sample["queue_seconds"] for sample in steps],
+        }, index=[sample["name"] for sample in steps]))
+    operations = [sample for sample in run["samples"] if sample["kind"] != "step"]
+    for sample in operations:
+        st.caption(f"{sample['kind'].replace('_', ' ').capitalize()} of {sample['name']}: "
+                   f"{sample['units']} units in {sample['seconds']:.2f}s")
+
+    # Latency and output speed per step profile (step_profiles.json)
+    if export["profiles"]:
+        st.subheader("Step profiles")
+        st.dataframe(pd.DataFrame([{
+            "profile": profile["profile"],
+            "steps": profile["steps"],
+            "requests": profile["requests"],
+            "mean seconds": profile["mean_seconds"],
+            "p95 seconds": profile["p95_seconds"],
+            "tokens/s": profile["tokens_per_second"],
+            "cost (USD)": round(profile["cost"], 4),
+        } for profile in export["profiles"]]), hide_index=True)
+
+    st.subheader("Step latency")
+    latencies = [sample["seconds"] for run in runs for sample in run["samples"]
+                 if sample["kind"] == "step" and sample["status"] != "reused"]
+    cumulative = [count for _, count in histogram(latencies)] + [len(latencies)]
+    labels = [f"{bound:6.2f}s" for bound in LATENCY_BUCKETS] + [f"> {LATENCY_BUCKETS[-1]}s"]
+    counts = [count - previous for count, previous in zip(cumulative, [0] + cumulative[:-1])]
+    st.bar_chart(pd.DataFrame({"steps": counts}, index=pd.Index(labels, name="up to")))
+
+    st.download_button("Export metrics as JSON", json.dumps(export, indent=2),
+                       file_name=f"{company_name}_metrics.json", mime="application/json", key="metrics_json")
+    st.download_button("Export metrics for Prometheus", to_prometheus(export),
+                       file_name=f"{company_name}_metrics.prom", mime="text/plain", key="metrics_prometheus")
+
+# Prompts and instructions are read once per server process; reruns reuse them
+@st.cache_resource
+def load_config():
+    # Load instructions from JSON file
+    with open('instructions.json', 'r') as f:
+        instructions = json.load(f)
+
+    # Load prompts from JSON file
+    with open('prompts.json', 'r') as f:
+        prompts = json.load(f)
+    return instructions, prompts
+
+instructions, prompts = load_config()
 
 # Create a folder to save uploaded files if it doesn't exist
 if not os.path.exists("uploads"):
@@ -66,23 +243,32 @@ if not os.path.exists(output_folder):
 if 'user_data' not in st.session_state:
     st.session_state['user_data'] = {'usernames': [], 'passwords': []}
 
-def add_user():
-
+# Password hashes are computed once per server process; bcrypt is deliberately slow
+@st.cache_resource
+def hashed_users():
     predefined_users = {
         " bm1961": "Charlotte-182",
         "sam2": "54321"
     }
 
-    for username, password in predefined_users.items():
-        hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-        st.session_state['user_data']['usernames'].append(username)
-        st.session_state['user_data']['passwords'].append(hashed_password)
+    return {
+        username: bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+        for username, password in predefined_users.items()
+    }
+
+def add_user():
+    users = hashed_users()
+    st.session_state['user_data'] = {'usernames': list(users), 'passwords': list(users.values())}
     
 
 
 
-# Get the styles and HTML for the background and logo
-page_bg_img, logo_html = get_page_bg_and_logo_styles()
+# Get the styles and HTML for the background and logo, encoded once per server process
+@st.cache_resource
+def page_styles():
+    return get_page_bg_and_logo_styles()
+
+page_bg_img, logo_html = page_styles()
 
 # Apply CSS and HTML
 st.markdown(page_bg_img, unsafe_allow_html=True)
@@ -92,9 +278,20 @@ st.markdown(logo_html, unsafe_allow_html=True)
 def main():
 
     
+    from artifacts import ArtifactIndex
+    from bundles import company_bundle
+    from jobs import POLL_SECONDS
+    from keyword_store import KeywordStore
+    from pipeline import Pipeline, artifact_file_names, pillar_page_names, pillar_page_upload_path
+
+    start_worker(api_key, st.secrets["general"].get("OPENAI_BASE_URL"))
+    job_queue = get_job_queue()
+
     st.title("Document Analysis and Processing")
     # Tabs: Upload documents and specify company name, Run GPT Tasks, Upload CSV Files, Download Specific Outputs, Upload Pillar Page
-    tab1, tab2, tab3, tab4, tab5 ,tab6= st.tabs(["Upload Documents", "Run GPT Tasks", "Upload CSV Files", "Download Specific Outputs", "Upload Pillar Page","Download all files"])
+    tab1, tab2, tab3, tab4, tab5 ,tab6, tab7 = st.tabs(["Upload Documents", "Run GPT Tasks", "Upload CSV Files", "Download Specific Outputs", "Upload Pillar Page","Download all files", "Run Metrics"])
+    # Set when a shown job is still queued or running, so the page polls for progress
+    active = False
 
     with tab1:
         st.header("Upload Documents")
@@ -138,144 +335,56 @@ def main():
     with tab2:
         st.header("Run GPT Tasks")
 
+        tab2_refresh = st.multiselect(
+            "Regenerate these steps instead of reusing cached responses",
+            [step.name for step in Pipeline(company_name, prompts, instructions, None).tab2_steps()],
+            key="tab2_refresh",
+        )
+
         if st.button("Run Tasks"):
             if company_name:
-                document_contents = {}
                 all_files_present = True
                 for file_name in required_files:
                     file_path = os.path.join("uploads", f"{company_name}_{file_name}")
-                    if os.path.exists(file_path):
-                        document_contents[file_name] = read_pdf(file_path)
-                    else:
+                    if not os.path.exists(file_path):
                         st.error(f"File {file_name} not found. Please upload it in the first tab.")
                         all_files_present = False
                         break
                 
                 if all_files_present:
-                    # Separate document texts
-                    product_list_text = document_contents.get("product_list.pdf", "")
-                    USP_text = document_contents.get("USP.pdf", "")
-                    key_stats_text = document_contents.get("key_stats.pdf", "")
-                    about_us_text = document_contents.get("about_us.pdf", "")
-                    colour_scheme_text = document_contents.get("colour_scheme.pdf", "")
-                    
-                    # 1. Buyer Persona
-                    prompt_buyer_persona = prompts["prompt_buyer_persona"].format(company_name=company_name, product_list=product_list_text, USP=USP_text, key_stats=key_stats_text, about_us=about_us_text)
-                    buyer_persona = run_gpt_task(instructions["buyer_persona"], prompt_buyer_persona)
-                    with open(os.path.join("processed", f"{company_name}_buyer_persona.txt"), "w") as f:
-                        f.write(buyer_persona)
-                    
-                    # 2. English Editor for Buyer Persona
-                    prompt_english_editor = prompts["prompt_english_editor"].format(file_name=f"{company_name}_buyer_persona.txt", file_content=buyer_persona)
-                    english_editor_output = run_gpt_task(instructions["english_editor"], prompt_english_editor)
-                    with open(os.path.join("processed", f"{company_name}_buyer_persona.txt"), "w") as f:
-                        f.write(english_editor_output)
-                    
-                    # 3. Mission Statement
-                    prompt_mission_statement = prompts["prompt_mission_statement"].format(company_name=company_name, product_list=product_list_text, USP=USP_text, key_stats=key_stats_text, about_us=about_us_text, buyer_persona=buyer_persona)
-                    mission_values = run_gpt_task(instructions["mission_statement"], prompt_mission_statement)
-                    with open(os.path.join("processed", f"{company_name}_mission_values.txt"), "w") as f:
-                        f.write(mission_values)
-                    
-                    # 4. English Editor for Mission Values
-                    prompt_english_editor_mission = prompts["prompt_english_editor"].format(file_name=f"{company_name}_mission_values.txt", file_content=mission_values)
-                    english_editor_mission_output = run_gpt_task(instructions["english_editor"], prompt_english_editor_mission)
-                    with open(os.path.join("processed", f"{company_name}_mission_values.txt"), "w") as f:
-                        f.write(english_editor_mission_output)
-                    
-                    # 5. SEO Summarizer
-                    prompt_seo_summarizer = prompts["prompt_seo_summarizer"].format(product_list=product_list_text, USP=USP_text, key_stats=key_stats_text, about_us=about_us_text, buyer_persona=buyer_persona)
-                    seo_summarizer_output = run_gpt_task(instructions["seo_summarizer"], prompt_seo_summarizer)
-                    with open(os.path.join("processed", f"{company_name}_seo_summarizer.txt"), "w") as f:
-                        f.write(seo_summarizer_output)
-                    
-                    # 6. English Editor for SEO Summarizer
-                    prompt_english_editor_seo = prompts["prompt_english_editor"].format(file_name=f"{company_name}_seo_summarizer.txt", file_content=seo_summarizer_output)
-                    english_editor_seo_output = run_gpt_task(instructions["english_editor"], prompt_english_editor_seo)
-                    with open(os.path.join("processed", f"{company_name}_seo_summarizer.txt"), "w") as f:
-                        f.write(english_editor_seo_output)
-                    
-                    # 7. SEO Keywords
-                    prompt_magic_words = prompts["prompt_magic_words"].format(english_editor_seo_output=english_editor_seo_output)
-                    seo_keywords = run_gpt_task(instructions["magic_words"], prompt_magic_words)
-                    with open(os.path.join("processed", f"{company_name}_seo_keywords.txt"), "w") as f:
-                        f.write(seo_keywords)
-                    
-                    # Zip the specific output files for download
-                    with ZipFile(os.path.join("processed", f"{company_name}_specific_outputs_tab2.zip"), "w") as zipf:
-                        zipf.write(os.path.join("processed", f"{company_name}_buyer_persona.txt"), f"{company_name}_buyer_persona.txt")
-                        zipf.write(os.path.join("processed", f"{company_name}_mission_values.txt"), f"{company_name}_mission_values.txt")
-                        zipf.write(os.path.join("processed", f"{company_name}_seo_summarizer.txt"), f"{company_name}_seo_summarizer.txt")
-                        zipf.write(os.path.join("processed", f"{company_name}_seo_keywords.txt"), f"{company_name}_seo_keywords.txt")
-
-                    st.success("GPT tasks for Tab 2 have been run and files are zipped!")
-                    # with open(os.path.join("processed", f"{company_name}_specific_outputs_tab2.zip"), "rb") as zipf:
-                    #     st.download_button("Download Output Files for Tab 2", zipf, file_name=f"{company_name}_specific_outputs_tab2.zip")
+                    # The worker runs independent steps (e.g. mission statement and SEO summary)
+                    # concurrently, skips steps whose inputs are unchanged and zips the outputs
+                    job_queue.submit(company_name, "tab2", {"refresh": tab2_refresh})
             else:
                 st.error("Please specify the company name in the first tab.")
 
+        if company_name:
+            active = show_job(company_name, "tab2", "GPT tasks for Tab 2 have been run and files are zipped!",
+                              "Download Output Files for Tab 2") or active
+
 
     with tab3:
         st.header("Upload CSV Files")
         
         csv_files = st.file_uploader("Upload CSV files", type="csv", accept_multiple_files=True)
+        # Uploads are added to the company's keywords; tick this to start again from just these files
+        replace_csv = st.checkbox("Replace previously uploaded keyword files", key="tab3_replace")
         
         if csv_files and st.button("Process CSV Files"):
             if company_name:
-                csv_file_paths = []
-                for i, file in enumerate(csv_files):
-                    file_path = os.path.join("uploads", f"{company_name}_csv_file_{i + 1}.csv")
-                    with open(file_path, "wb") as f:
-                        f.write(file.getbuffer())
-                    csv_file_paths.append(file_path)
+                store = KeywordStore(company_name)
+                if replace_csv:
+                    store.clear()
+                added = [file.name for file in csv_files if store.add_csv(file, file.name)]
                 
-                if csv_file_paths:
-                    # Load the CSV files
-                    dataframes = []
-                    for i, file_path in enumerate(csv_file_paths):
-                        df = pd.read_csv(file_path)
-                        df['Source'] = f'{company_name}_csv_file_{i + 1}'  # Add source column with company name
-                        dataframes.append(df)
-
-                    # Concatenate the dataframes
-                    combined_df = pd.concat(dataframes, ignore_index=True)
-
-                    # Data cleaning
-                    combined_df['Volume'] = pd.to_numeric(combined_df['Volume'], errors='coerce').fillna(0)
-                    combined_df['Keyword Difficulty'] = pd.to_numeric(combined_df['Keyword Difficulty'], errors='coerce').fillna(100)
-                    combined_df['CPC (GBP)'] = pd.to_numeric(combined_df['CPC (GBP)'], errors='coerce').fillna(0)
-
-                    # Filter and score
-                    combined_df = combined_df[(combined_df['Volume'] >= 20) | 
-                                            (combined_df['CPC (GBP)'] >= 0.35) | 
-                                            ((combined_df['Keyword Difficulty'] <= 50) & 
-                                            (combined_df['Keyword Difficulty'] >= 10)) | 
-                                            (combined_df['Keyword Difficulty'].isna())]
-                    combined_df['Score'] = np.log(combined_df['Volume']) / combined_df['CPC (GBP)']
-
-                    # Select top 150 keywords
-                    top_keywords_list = []
-                    remaining_slots = 150
-                    for source, group in combined_df.groupby('Source'):
-                        group_top = group.nlargest(15, 'Score')
-                        top_keywords_list.append(group_top)
-                        remaining_slots -= len(group_top)
-                        if remaining_slots <= 0:
-                            break
-
-                    if remaining_slots > 0:
-                        remaining_keywords = combined_df[~combined_df.index.isin(pd.concat(top_keywords_list).index)]
-                        additional_keywords = remaining_keywords.nlargest(remaining_slots, 'Score')
-                        top_keywords_list.append(additional_keywords)
-
-                    top_keywords = pd.concat(top_keywords_list).nlargest(150, 'Score')['Keyword']
-
-                    # Save the top keywords
-                    output_file = os.path.join("processed", f"{company_name}_top_150_keywords.csv")
-                    top_keywords.to_csv(output_file, index=False)
-
-                    st.success("CSV files processed and top 150 keywords saved!")
-                    # with open(output_file, "rb") as f:
+                if store.members:
+                    store.top_keywords()
+
+                    if added:
+                        st.success(f"Added {len(added)} CSV file(s); top 150 keywords saved!")
+                    else:
+                        st.success("These CSV files were already uploaded; top 150 keywords are unchanged.")
+                    # with open(os.path.join("processed", f"{company_name}_top_150_keywords.csv"), "rb") as f:
                     #     st.download_button("Download Top 150 Keywords", f, file_name=f"{company_name}_top_150_keywords.csv")
                 else:
                     st.error("No CSV files found.")
@@ -286,181 +395,58 @@ def main():
 
     with tab4:
         st.header("Download Specific Outputs")
-        
+
+        tab4_refresh = st.multiselect(
+            "Regenerate these steps instead of reusing cached responses",
+            [step.name for step in Pipeline(company_name, prompts, instructions, None).tab4_steps()],
+            key="tab4_refresh",
+        )
+
         if st.button("Run Topic Cluster and Web Page Tasks"):
             if company_name:
-                document_contents = {}
-                for file_name in required_files:
-                    file_path = os.path.join("uploads", f"{company_name}_{file_name}")
-                    if os.path.exists(file_path):
-                        document_contents[file_name] = read_pdf(file_path)
-                
-                product_list_text = document_contents.get("product_list.pdf", "")
-                USP_text = document_contents.get("USP.pdf", "")
-                key_stats_text = document_contents.get("key_stats.pdf", "")
-                about_us_text = document_contents.get("about_us.pdf", "")
-                colour_scheme_text = document_contents.get("colour_scheme.pdf", "")
-
-                with open(os.path.join("processed", f"{company_name}_buyer_persona.txt"), "r") as f:
-                    buyer_persona = f.read()
-                with open(os.path.join("processed", f"{company_name}_top_150_keywords.csv"), "r") as f:
-                    top_keywords = f.read()
-                with open(os.path.join("processed", f"{company_name}_mission_values.txt"), "r") as f:
-                    mission_values = f.read()
-
-                # 1. Topic Cluster Analysis
-                prompt_topic_cluster = prompts["prompt_topic_cluster"].format(company_name=company_name, product_list=product_list_text,  buyer_persona=buyer_persona, seo_keywords=top_keywords)
-                topic_cluster_document = run_gpt_task(instructions["topic_cluster"], prompt_topic_cluster)
-                with open(os.path.join("processed", f"{company_name}_topic_cluster_document.txt"), "w") as f:
-                    f.write(topic_cluster_document)
-
-                prompt_extract_keywords = prompts["prompt_extract_keywords"].format(topic_cluster_document=topic_cluster_document)
-                keywords = run_gpt_task(instructions["editor"], prompt_extract_keywords)
-                with open(os.path.join("processed", f"{company_name}_keywords.txt"), "w") as f:
-                    f.write(keywords)
-
-                prompt_website_structure = prompts["prompt_website_structure"].format(company_name=company_name, product_list=product_list_text, USP=USP_text, key_stats=key_stats_text, about_us=about_us_text, buyer_persona=buyer_persona, topic_cluster_document=topic_cluster_document, keywords=keywords)
-                website_structure_document = run_gpt_task(instructions["website_structure"], prompt_website_structure)
-                with open(os.path.join("processed", f"{company_name}_website_structure_document.txt"), "w") as f:
-                    f.write(website_structure_document)
-
-                prompt_brand_voice = prompts["prompt_brand_voice"].format(company_name=company_name, product_list=product_list_text, USP=USP_text, key_stats=key_stats_text, about_us=about_us_text, buyer_persona=buyer_persona, mission_values=mission_values, topic_cluster_document=topic_cluster_document, keywords=keywords)
-                brand_voice = run_gpt_task(instructions["brand_voice"], prompt_brand_voice)
-                with open(os.path.join("processed", f"{company_name}_brand_voice.txt"), "w") as f:
-                    f.write(brand_voice)
-                
-                prompt_english_editor_brand = prompts["prompt_english_editor"].format(file_name=f"{company_name}_brand_voice.txt", file_content=brand_voice)
-                english_editor_brand_output = run_gpt_task(instructions["english_editor"], prompt_english_editor_brand)
-                with open(os.path.join("processed", f"{company_name}_brand_voice.txt"), "w") as f:
-                    f.write(english_editor_brand_output)
-                
-                prompt_extract_home_page = prompts["prompt_extract_home_page"].format(website_structure_document=website_structure_document)
-                home_page_structure = run_gpt_task(instructions["editor"], prompt_extract_home_page)
-                
-                with open(os.path.join("processed", f"{company_name}_brand_voice.txt"), "r") as f:
-                    brand_voice_text = f.read()
-                with open(os.path.join("processed", f"{company_name}_keywords.txt"), "r") as f:
-                    keywords = f.read()
-                    
-                prompt_home_page = prompts["prompt_home_page"].format(company_name=company_name, product_list=product_list_text, USP=USP_text, key_stats=key_stats_text, about_us=about_us_text, brand_voice_text=brand_voice_text, keywords=keywords)
-                home_page_document = run_gpt_task(instructions["home_page"], prompt_home_page)
-                with open(os.path.join("processed", f"{company_name}_home_page.txt"), "w") as f:
-                    f.write(home_page_document)
-
-                prompt_english_editor_home = prompts["prompt_english_editor"].format(file_name=f"{company_name}_home_page.txt", file_content=home_page_document)
-                home_page_final = run_gpt_task(instructions["english_editor"], prompt_english_editor_home)
-                with open(os.path.join("processed", f"{company_name}_home_page_final.txt"), "w") as f:
-                    f.write(home_page_final)
-
-                prompt_extract_about_us = prompts["prompt_extract_about_us"].format(website_structure_document=website_structure_document)
-                about_us_structure = run_gpt_task(instructions["editor"], prompt_extract_about_us)
-
-                prompt_about_us = prompts["prompt_about_us"].format(company_name=company_name, product_list=product_list_text, USP=USP_text, key_stats=key_stats_text, about_us=about_us_text,  brand_voice_text=brand_voice_text, keywords=keywords)
-                about_us_document = run_gpt_task(instructions["about_us"], prompt_about_us)
-                with open(os.path.join("processed", f"{company_name}_about_us.txt"), "w") as f:
-                    f.write(about_us_document)
-
-                prompt_english_editor_about_us = prompts["prompt_english_editor"].format(file_name=f"{company_name}_about_us.txt", file_content=about_us_document)
-                about_us_final = run_gpt_task(instructions["english_editor"], prompt_english_editor_about_us)
-                with open(os.path.join("processed", f"{company_name}_about_us_final.txt"), "w") as f:
-                    f.write(about_us_final)
-
-                # Zip the specific outputs for download
-                with ZipFile(os.path.join("processed", f"{company_name}_specific_outputs_tab4.zip"), "w") as zipf:
-                    zipf.write(os.path.join("processed", f"{company_name}_topic_cluster_document.txt"), f"{company_name}_topic_cluster_document.txt")
-                    zipf.write(os.path.join("processed", f"{company_name}_keywords.txt"), f"{company_name}_keywords.txt")
-                    zipf.write(os.path.join("processed", f"{company_name}_website_structure_document.txt"), f"{company_name}_website_structure_document.txt")
-                    zipf.write(os.path.join("processed", f"{company_name}_brand_voice.txt"), f"{company_name}_brand_voice.txt")
-                    zipf.write(os.path.join("processed", f"{company_name}_home_page.txt"), f"{company_name}_home_page.txt")
-                    zipf.write(os.path.join("processed", f"{company_name}_home_page_final.txt"), f"{company_name}_home_page_final.txt")
-                    zipf.write(os.path.join("processed", f"{company_name}_about_us.txt"), f"{company_name}_about_us.txt")
-                    zipf.write(os.path.join("processed", f"{company_name}_about_us_final.txt"), f"{company_name}_about_us_final.txt")
-                
-                st.success("Specific outputs have been processed!")
-                # with open(os.path.join("processed", f"{company_name}_specific_outputs_tab4.zip"), "rb") as f:
-                #     st.download_button("Download Specific Outputs", f, file_name=f"{company_name}_specific_outputs_tab4.zip")
+                # The home page and about us branches, and their editor passes, run concurrently.
+                # Queued after any tab2 job of the company, whose outputs it reads.
+                job_queue.submit(company_name, "tab4", {"refresh": tab4_refresh})
             else:
                 st.error("Please specify the company name in the first tab.")
 
+        if company_name:
+            active = show_job(company_name, "tab4", "Specific outputs have been processed!",
+                              "Download Specific Outputs") or active
+
 
     with tab5:
-        st.header("Upload Pillar Page")
-        
-        pillar_page_file = st.file_uploader("Upload a Pillar Page PDF", type="pdf")
+        st.header("Upload Pillar Pages")
         
-        if pillar_page_file:
-            pillar_page_path = os.path.join("uploads", f"{company_name}_pillar_page.pdf")
-            with open(pillar_page_path, "wb") as f:
-                f.write(pillar_page_file.getbuffer())
-            
-            pillar_page_content = read_pdf(pillar_page_path)
+        # Every PDF is a pillar page of its own, with output files named after it
+        pillar_page_files = st.file_uploader("Upload Pillar Page PDFs", type="pdf", accept_multiple_files=True)
+        tab5_refresh = st.checkbox("Regenerate instead of reusing cached responses", key="tab5_refresh")
 
-        if st.button("Process Pillar Page"):
+        if st.button("Process Pillar Pages"):
             if company_name:
-                # Read content from the saved PDFs
-                document_contents = {}
-                for file_name in required_files:
-                    file_path = os.path.join("uploads", f"{company_name}_{file_name}")
-                    if os.path.exists(file_path):
-                        document_contents[file_name] = read_pdf(file_path)
-                        
-                # Separate document texts
-                product_list_text = document_contents.get("product_list.pdf", "")
-                USP_text = document_contents.get("USP.pdf", "")
-                key_stats_text = document_contents.get("key_stats.pdf", "")
-                about_us_text = document_contents.get("about_us.pdf", "")
-                colour_scheme_text = document_contents.get("colour_scheme.pdf", "")
-                
-                # Read the existing files
-                with open(os.path.join("processed", f"{company_name}_buyer_persona.txt"), "r") as f:
-                    buyer_persona = f.read()
-                with open(os.path.join("processed", f"{company_name}_top_150_keywords.csv"), "r") as f:
-                    top_keywords = f.read()
-                with open(os.path.join("processed", f"{company_name}_mission_values.txt"), "r") as f:
-                    mission_values = f.read()
-                with open(os.path.join("processed",f"{company_name}_brand_voice.txt"), "r") as f:
-                    brand_voice = f.read()
-                with open(os.path.join("processed", f"{company_name}_keywords.txt"), "r") as f:
-                    keywords = f.read()
-                
-                # Ensure pillar_page_content is read only if pillar_page_file was uploaded
-                if pillar_page_file:
-                    pillar_page_content = read_pdf(pillar_page_path)
-
-                    # Generate the prompt for the pillar page
-                    prompt_pillar_page = prompts["prompt_pillar_page"].format(
-                        company_name=company_name, 
-                        pillar_page_content=pillar_page_content, 
-                        product_list=product_list_text, 
-                        USP=USP_text, 
-                        key_stats=key_stats_text, 
-                        about_us=about_us_text, 
-                        brand_voice_text=brand_voice, 
-                        keywords=keywords
-                    )
-                    pillar_page_document = run_gpt_task(instructions["pillar_page"], prompt_pillar_page)
-                    with open(os.path.join("processed", f"{company_name}_pillar_page.txt"), "w") as f:
-                        f.write(pillar_page_document)
-                    
-                    # English Editor for Pillar Page
-                    prompt_english_editor_pillar = prompts["prompt_english_editor"].format(file_name=f"{company_name}_pillar_page.txt", file_content=pillar_page_document)
-                    pillar_page_final = run_gpt_task(instructions["english_editor"], prompt_english_editor_pillar)
-                    with open(os.path.join("processed", f"{company_name}_pillar_page_final.txt"), "w") as f:
-                        f.write(pillar_page_final)
-
-                    # Zip the pillar page files for download
-                    with ZipFile(os.path.join("processed", f"{company_name}_specific_outputs_tab5.zip"), "w") as zipf:
-                        zipf.write(os.path.join("processed", f"{company_name}_pillar_page.txt"), f"{company_name}_pillar_page.txt")
-                        zipf.write(os.path.join("processed", f"{company_name}_pillar_page_final.txt"), f"{company_name}_pillar_page_final.txt")
-                    
-                    st.success("Pillar page has been processed and edited!")
-                    # with open(os.path.join("processed", f"{company_name}_specific_outputs_tab5.zip"), "rb") as f:
-                        # st.download_button("Download Pillar Page Files", f, file_name=f"{company_name}_specific_outputs_tab5.zip")
+                if pillar_page_files:
+                    pages = pillar_page_names([file.name for file in pillar_page_files])
+                    pillar_pages = {}
+                    for page, pillar_page_file in zip(pages, pillar_page_files):
+                        pillar_page_path = pillar_page_upload_path(company_name, page)
+                        os.makedirs(os.path.dirname(pillar_page_path), exist_ok=True)
+                        with open(pillar_page_path, "wb") as f:
+                            f.write(pillar_page_file.getbuffer())
+                        pillar_pages[page] = pillar_page_path
+                    refresh = []
+                    if tab5_refresh:
+                        refresh = [step.name for step in Pipeline(company_name, prompts, instructions, None).tab5_steps(pages)]
+                    # The pages run concurrently in one job, sharing the brand voice and keywords
+                    job_queue.submit(company_name, "tab5", {"pillar_pages": pillar_pages, "refresh": refresh})
                 else:
-                    st.error("Please upload the Pillar Page PDF.")
+                    st.error("Please upload at least one Pillar Page PDF.")
             else:
                 st.error("Please specify the company name in the first tab.")
 
+        if company_name:
+            active = show_job(company_name, "tab5", "Pillar pages have been processed and edited!",
+                              "Download Pillar Page Files", partial_download=True) or active
+
 
 
 
@@ -468,27 +454,20 @@ def main():
         st.header("Download and Overwrite Files")
 
         if company_name:
-            file_dict = {}
-            
-            # Scan the 'processed' folder for files
-            for root, dirs, files in os.walk("processed"):
-                for file in files:
-                    if company_name in file:
-                        file_path = os.path.join(root, file)
-                        base_name, ext = os.path.splitext(file)
-                        
-                        # Check if the file has a final version
-                        final_version = f"{base_name}_final{ext}"
-                        if final_version in files:
-                            file_to_offer = final_version
-                        else:
-                            file_to_offer = file
-                        
-                        # Store the file paths for download
-                        file_dict[file_to_offer] = os.path.join(root, file_to_offer)
+            # Look up the company's files in the artifact index; files with a final
+            # version are offered in that version only
+            artifact_index = ArtifactIndex()
+            # Picks up files of companies processed before the index existed; a no-op after the first time
+            artifact_index.backfill(company_name, artifact_file_names())
+            file_dict = artifact_index.downloads(company_name)
             
             if file_dict:
                 st.success("Select a file from the dropdown menu to download!")
+                # Every listed file in one zip, rebuilt only when one of them changed
+                bundle = company_bundle(company_name, index=artifact_index)
+                if bundle:
+                    st.download_button("Download all files", bundle[1], file_name=bundle[0], mime="application/zip",
+                                       key="tab6_bundle")
                 # Create a dropdown menu for file selection
                 selected_file = st.selectbox("Select a file to download", options=list(file_dict.keys()))
 
@@ -507,12 +486,26 @@ def main():
                         new_file_path = os.path.join("processed", f"{uploaded_file.name}")
                         with open(new_file_path, "wb") as f:
                             f.write(uploaded_file.getbuffer())
+                        artifact_index.record(company_name, new_file_path, "upload")
                         st.success(f"File {uploaded_file.name} has been re-uploaded and saved as {new_file_path}")
             else:
                 st.warning("No files found for the specified company.")
         else:
             st.error("Please specify the company name in the first tab.")
 
+    with tab7:
+        st.header("Run Metrics")
+
+        if company_name:
+            show_metrics(company_name)
+        else:
+            st.error("Please specify the company name in the first tab.")
+
+    # Poll the job queue; any widget interaction interrupts the wait and reruns straight away
+    if active:
+        time.sleep(POLL_SECONDS)
+        st.experimental_rerun()
+
 def login():
     st.title("Login")
     username = st.text_input("Username")
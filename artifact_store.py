@@ -0,0 +1,170 @@
+import atexit
+import os
+import threading
+import traceback
+from collections import OrderedDict
+
+from artifacts import ArtifactIndex
+from atomic_files import atomic_write
+
+# Upper bound on the text kept in memory; least recently used persisted entries go first
+MAX_HOT_BYTES = 64 * 1024 * 1024
+
+
+class _Entry:
+    def __init__(self, value, version):
+        self.value = value
+        self.version = version
+        # (mtime_ns, size) of the file once this version is on disk
+        self.stat = None
+
+
+class _Write:
+    def __init__(self, value, version, company_name, source, final):
+        self.value = value
+        self.version = version
+        self.company_name = company_name
+        self.source = source
+        self.final = final
+        self.callbacks = []
+
+
+# Text artifacts (step outputs and drafts) that steps write and read through.
+# Writes go to memory and are persisted by a background thread with an atomic
+# rename; a later write to the same file before it is persisted replaces the
+# earlier one. Reads are served from memory while the file on disk is the one
+# this store wrote, so a file changed by another process or a user re-upload
+# is read again. `on_persisted` callbacks run once the value is on disk, so
+# whatever they record never points at a file that is not written yet.
+class ArtifactStore:
+    def __init__(self, index=None, max_bytes=MAX_HOT_BYTES):
+        self.index = index
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._versions = {}
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._writing = None
+        self._thread = None
+
+    # Function to store a value for `path` and queue it for writing. With a
+    # company name the file is recorded in the artifact index once written.
+    def write(self, path, value, company_name=None, source="step", final=False, on_persisted=None):
+        with self._cond:
+            version = self._versions.get(path, 0) + 1
+            self._versions[path] = version
+            self._remember(path, _Entry(value, version))
+
+            write = _Write(value, version, company_name, source, final)
+            previous = self._pending.pop(path, None)
+            if previous is not None:
+                write.callbacks.extend(previous.callbacks)
+            if on_persisted is not None:
+                write.callbacks.append(on_persisted)
+            self._pending[path] = write
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer, daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            self._cond.notify_all()
+
+    # Function to return the current text of `path`, or None if there is none
+    def read(self, path):
+        with self._cond:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if path in self._pending or self._writing == path:
+                    self._entries.move_to_end(path)
+                    return entry.value
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    self._forget(path)
+                    return None
+                if entry.stat == (stat.st_mtime_ns, stat.st_size):
+                    self._entries.move_to_end(path)
+                    return entry.value
+
+        try:
+            with open(path, "r") as f:
+                value = f.read()
+                stat = os.fstat(f.fileno())
+        except FileNotFoundError:
+            return None
+        with self._cond:
+            if path not in self._pending and self._writing != path:
+                entry = _Entry(value, self._versions.get(path, 0))
+                entry.stat = (stat.st_mtime_ns, stat.st_size)
+                self._remember(path, entry)
+        return value
+
+    # Function to wait until every queued write is on disk
+    def flush(self):
+        with self._cond:
+            while self._pending or self._writing is not None:
+                self._cond.wait()
+
+    def _remember(self, path, entry):
+        self._forget(path)
+        self._entries[path] = entry
+        self._size += len(entry.value)
+        # Only entries already on disk can be dropped
+        for other in list(self._entries):
+            if self._size <= self.max_bytes:
+                break
+            if other != path and other not in self._pending and other != self._writing:
+                self._forget(other)
+
+    def _forget(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._size -= len(entry.value)
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                path, write = self._pending.popitem(last=False)
+                self._writing = path
+
+            try:
+                atomic_write(path, write.value)
+                stat = os.stat(path)
+                if self.index is not None and write.company_name:
+                    self.index.record(write.company_name, path, write.source, final=write.final,
+                                      content=write.value.encode("utf-8"))
+                persisted = True
+            except Exception:
+                traceback.print_exc()
+                persisted = False
+
+            if persisted:
+                with self._cond:
+                    entry = self._entries.get(path)
+                    if entry is not None and entry.version == write.version:
+                        entry.stat = (stat.st_mtime_ns, stat.st_size)
+                for callback in write.callbacks:
+                    try:
+                        callback()
+                    except Exception:
+                        traceback.print_exc()
+
+            with self._cond:
+                self._writing = None
+                self._cond.notify_all()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Function to return the process-wide store, which records files in the artifact index
+def default_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore(ArtifactIndex())
+        return _store
@@ -0,0 +1,110 @@
+import hashlib
+import os
+import time
+
+from sqlite_db import connect
+
+ARTIFACT_DB = os.path.join("processed", ".artifacts", "index.sqlite")
+
+
+# Function to return the name an artifact's draft and final versions share:
+# "acme_about_us_final.txt" and "acme_about_us.txt" both give "acme_about_us.txt"
+def base_name(file_name):
+    stem, ext = os.path.splitext(file_name)
+    if stem.endswith("_final"):
+        stem = stem[:-len("_final")]
+    return stem + ext
+
+
+# Index of the files each company has in processed/: what wrote them, their type,
+# size, content hash, a version that goes up whenever the content changes, and
+# whether they are a final (edited) or draft version. Writers record files as
+# they write them, so listing a company's files never scans the folder.
+class ArtifactIndex:
+    def __init__(self, path=ARTIFACT_DB):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                " company_name TEXT NOT NULL,"
+                " file_name TEXT NOT NULL,"
+                " path TEXT NOT NULL,"
+                " base_name TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " source TEXT NOT NULL,"
+                " final INTEGER NOT NULL,"
+                " version INTEGER NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " hash TEXT NOT NULL,"
+                " updated REAL NOT NULL,"
+                " PRIMARY KEY (company_name, file_name))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS backfilled (company_name TEXT PRIMARY KEY)")
+
+    # Function to record a file a company's run or user just wrote. `source` says
+    # what wrote it ("step", "keywords", "zip", "upload"); `final` defaults to
+    # whether the name ends in "_final". The version only goes up when the content
+    # changed. Writers holding the file's bytes pass them as `content` to skip re-reading it.
+    def record(self, company_name, path, source, final=None, content=None):
+        digest = hashlib.sha256()
+        if content is not None:
+            digest.update(content)
+        else:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        file_name = os.path.basename(path)
+        if final is None:
+            final = os.path.splitext(file_name)[0].endswith("_final")
+
+        with connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT version, hash FROM artifacts WHERE company_name = ? AND file_name = ?",
+                (company_name, file_name),
+            ).fetchone()
+            version = 1 if row is None else row["version"] + (row["hash"] != digest.hexdigest())
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts"
+                " (company_name, file_name, path, base_name, kind, source, final, version, size, hash, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (company_name, file_name, path, base_name(file_name), os.path.splitext(file_name)[1].lstrip("."),
+                 source, int(final), version, os.path.getsize(path), digest.hexdigest(), time.time()),
+            )
+
+    def artifacts(self, company_name):
+        with connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT * FROM artifacts WHERE company_name = ? ORDER BY file_name", (company_name,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    # Function to return {file_name: path} of the files to offer for download:
+    # for an artifact with a final version only the final one is listed. Files
+    # deleted since they were recorded are left out.
+    def downloads(self, company_name):
+        chosen = {}
+        for artifact in self.artifacts(company_name):
+            if not os.path.exists(artifact["path"]):
+                continue
+            current = chosen.get(artifact["base_name"])
+            if current is None or (artifact["final"], artifact["file_name"]) > (current["final"], current["file_name"]):
+                chosen[artifact["base_name"]] = artifact
+        return {artifact["file_name"]: artifact["path"] for artifact in chosen.values()}
+
+    # Function to index, once per company, the files it had in processed/ before
+    # the index existed. Only the given names under the exact "<company_name>_"
+    # prefix are checked, so one company's files never match another's.
+    def backfill(self, company_name, file_names, directory="processed"):
+        with connect(self.path) as conn:
+            if conn.execute("SELECT 1 FROM backfilled WHERE company_name = ?", (company_name,)).fetchone():
+                return
+        known = {artifact["file_name"] for artifact in self.artifacts(company_name)}
+        for file_name in file_names:
+            path = os.path.join(directory, f"{company_name}_{file_name}")
+            if os.path.basename(path) not in known and os.path.exists(path):
+                self.record(company_name, path, "scan")
+        with connect(self.path) as conn:
+            conn.execute("INSERT OR IGNORE INTO backfilled (company_name) VALUES (?)", (company_name,))
@@ -0,0 +1,29 @@
+import os
+import threading
+from contextlib import contextmanager
+
+
+# Function to give a writer a temporary path next to `path`, then move the finished
+# file into place, so readers see the old or the new file, never part of one. The
+# temporary file is named per process and thread, so concurrent writers never share
+# one, and it is removed if the writer fails.
+@contextmanager
+def atomic_path(path):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# Function to write a text (or bytes) file atomically
+def atomic_write(path, data, encoding=None):
+    with atomic_path(path) as tmp_path:
+        if isinstance(data, bytes):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        else:
+            with open(tmp_path, "w", encoding=encoding) as f:
+                f.write(data)
@@ -0,0 +1,250 @@
+"""Headless batch runner: process many companies through the tab2-tab5 pipeline.
+
+Usage:
+    python batch_runner.py manifest.json [--companies 4] [--max-requests 8] [--report report.json]
+
+The manifest lists the companies and the folder holding each one's uploads:
+
+    {"companies": [
+        {"company_name": "google", "uploads": "incoming/google"},
+        {"company_name": "fiverr", "uploads": "incoming/fiverr"}
+    ]}
+
+Each uploads folder holds product_list.pdf, USP.pdf, key_stats.pdf,
+about_us.pdf and colour_scheme.pdf (optionally prefixed with
+"<company_name>_"), the keyword CSV exports (*.csv) and, optionally,
+pillar_page.pdf or a pillar_pages/ folder of pillar page PDFs, which are
+processed concurrently with one pair of output files each. The runner writes the same processed/ artifacts and zips
+as the Streamlit tabs, then a JSON summary of per-company wall time and failures. Each tab's zip
+({company_name}_specific_outputs_{tab}.zip) is written once, at the end of the company's run, with the files
+that run wrote.
+
+An entry may list the outputs to produce per tab, for example
+{"outputs": {"tab4": ["home_page_final.txt", "prompt_services_page"]}}:
+file names, step names or prompts.json templates no tab wires in. Only the
+steps and documents those outputs need are run and parsed; tabs left out
+produce their usual files.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from artifact_store import default_store
+from gpt_client import GPTTransport
+from keyword_store import KeywordStore
+from metrics import RunMetrics
+from bundles import write_company_bundle
+from pipeline import (DOCUMENT_FILES, Pipeline, load_documents, pillar_page_names, pillar_page_upload_path,
+                      step_files, tab4_values, tab5_values, upload_path)
+from response_cache import ResponseCache
+from run_state import company_run_state
+from step_graph import given_inputs, run_steps
+from step_profiles import load_step_profiles
+
+
+# Function to find a company's file in its uploads folder, with or without the company prefix
+def find_upload(directory, company_name, file_name):
+    for candidate in (f"{company_name}_{file_name}", file_name):
+        path = os.path.join(directory, candidate)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+# Function to copy a company's uploads into uploads/ under the names the tabs use
+def stage_uploads(company_name, directory):
+    missing = []
+    for file_name in DOCUMENT_FILES.values():
+        source = find_upload(directory, company_name, file_name)
+        if source is None:
+            missing.append(file_name)
+        else:
+            shutil.copyfile(source, upload_path(company_name, file_name))
+    if missing:
+        raise FileNotFoundError(f"Missing documents in {directory}: {', '.join(missing)}")
+
+    # Keyword exports go into the company's keyword store rather than uploads/
+    store = KeywordStore(company_name)
+    store.clear()
+    csv_file_paths = sorted(glob.glob(os.path.join(directory, "*.csv")))
+    for source in csv_file_paths:
+        store.add_csv(source, os.path.basename(source))
+
+    pillar_page_path = None
+    source = find_upload(directory, company_name, "pillar_page.pdf")
+    if source is not None:
+        pillar_page_path = upload_path(company_name, "pillar_page.pdf")
+        shutil.copyfile(source, pillar_page_path)
+
+    pillar_pages = {}
+    sources = sorted(glob.glob(os.path.join(directory, "pillar_pages", "*.pdf")))
+    for page, source in zip(pillar_page_names(sources), sources):
+        pillar_pages[page] = pillar_page_upload_path(company_name, page)
+        os.makedirs(os.path.dirname(pillar_pages[page]), exist_ok=True)
+        shutil.copyfile(source, pillar_pages[page])
+    return csv_file_paths, pillar_page_path, pillar_pages
+
+
+# Function to run every tab's work for one company, timing each stage
+def process_company(entry, prompts, instructions, run_task, max_workers, profiles=None):
+    company_name = entry["company_name"]
+    result = {"company_name": company_name, "status": "ok", "stages": {}, "metrics": {}}
+    started = time.perf_counter()
+
+    def stage(name, func):
+        stage_started = time.perf_counter()
+        func()
+        result["stages"][name] = round(time.perf_counter() - stage_started, 3)
+
+    try:
+        csv_file_paths, pillar_page_path, pillar_pages = stage_uploads(company_name, entry["uploads"])
+        pipeline = Pipeline(company_name, prompts, instructions, run_task, profiles=profiles)
+        state = company_run_state(company_name)
+
+        outputs = entry.get("outputs", {})
+        # The files each tab's run writes, zipped once the company is done
+        tab_files = {}
+
+        # Each tab's steps and the PDFs it parses are recorded as one metrics run.
+        # `values(needed)` loads the given values the steps read
+        def run_tab(tab, steps, values):
+            run_metrics = RunMetrics(company_name, tab)
+            status = "failed"
+            try:
+                with run_metrics.active():
+                    values = values(given_inputs(steps))
+                run_steps(steps, values, max_workers, state=state, metrics=run_metrics)
+                status = "done"
+            finally:
+                run_metrics.save(status)
+            result["metrics"][tab] = run_metrics.summary()
+            tab_files[tab] = step_files(company_name, steps)
+
+        def tab2():
+            run_tab("tab2", pipeline.tab2_steps(outputs.get("tab2")), lambda needed: load_documents(company_name, needed))
+
+        def tab3():
+            if not csv_file_paths:
+                raise FileNotFoundError(f"No keyword CSV files in {entry['uploads']}")
+            KeywordStore(company_name).top_keywords()
+
+        def tab4():
+            run_tab("tab4", pipeline.tab4_steps(outputs.get("tab4")), lambda needed: tab4_values(company_name, needed))
+
+        def tab5():
+            if pillar_pages:
+                run_tab("tab5", pipeline.tab5_steps(pillar_pages, outputs.get("tab5")),
+                        lambda needed: tab5_values(company_name, pillar_pages=pillar_pages))
+            else:
+                run_tab("tab5", pipeline.tab5_steps(outputs=outputs.get("tab5")),
+                        lambda needed: tab5_values(company_name, pillar_page_path))
+
+        stage("tab2", tab2)
+        stage("tab3", tab3)
+        stage("tab4", tab4)
+        if pillar_page_path or pillar_pages:
+            stage("tab5", tab5)
+
+        # Outputs are written behind the run; zip them once they are all on disk
+        def zips():
+            default_store().flush()
+            for tab, file_names in tab_files.items():
+                write_company_bundle(company_name, tab, file_names)
+
+        stage("zips", zips)
+        result["reused_steps"] = state.skipped
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["traceback"] = traceback.format_exc()
+
+    result["wall_time"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def load_manifest(path):
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    companies = manifest["companies"] if isinstance(manifest, dict) else manifest
+    names = [entry["company_name"] for entry in companies]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Companies listed more than once: {sorted(duplicates)}")
+    return companies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the document analysis pipeline for many companies.")
+    parser.add_argument("manifest", help="JSON manifest of companies and their upload folders")
+    parser.add_argument("--companies", type=int, default=4, help="companies processed at the same time")
+    parser.add_argument("--max-requests", type=int, default=8, help="GPT requests in flight across all companies")
+    parser.add_argument("--step-workers", type=int, default=4, help="steps run at the same time within a company")
+    parser.add_argument("--report", default=os.path.join("processed", "batch_report.json"))
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"))
+    parser.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL"))
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("API key not found. Pass --api-key or set the OPENAI_API_KEY environment variable.")
+
+    companies = load_manifest(args.manifest)
+    with open("instructions.json", "r") as f:
+        instructions = json.load(f)
+    with open("prompts.json", "r") as f:
+        prompts = json.load(f)
+    profiles = load_step_profiles()
+    os.makedirs("uploads", exist_ok=True)
+    os.makedirs("processed", exist_ok=True)
+
+    # One transport for the whole batch, so --max-requests and the rate limits are global
+    transport = GPTTransport(
+        api_key=args.api_key,
+        base_url=args.base_url,
+        max_concurrency=args.max_requests,
+        cache=ResponseCache(),
+    )
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.companies)) as executor:
+            results = list(executor.map(
+                lambda entry: process_company(entry, prompts, instructions, transport.run_task, args.step_workers,
+                                              profiles),
+                companies,
+            ))
+    finally:
+        transport.close()
+        default_store().flush()
+
+    report = {
+        "wall_time": round(time.perf_counter() - started, 3),
+        "companies": len(results),
+        "failed": sum(1 for result in results if result["status"] != "ok"),
+        "cache": transport.cache.stats(),
+        "usage": transport.usage_totals,
+        "results": results,
+    }
+    report_dir = os.path.dirname(args.report)
+    if report_dir:
+        os.makedirs(report_dir, exist_ok=True)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for result in results:
+        line = f"{result['company_name']}: {result['status']} in {result['wall_time']}s"
+        if result["status"] != "ok":
+            line += f" ({result['error']})"
+        print(line)
+    print(f"{report['companies'] - report['failed']}/{report['companies']} companies succeeded "
+          f"in {report['wall_time']}s; report written to {args.report}")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""Local stand-in for the OpenAI chat completions API, for benchmarks and offline runs.
+
+Usage:
+    python -m benchmarks.mock_openai [--port 8000] [--latency 0.5] [--tokens-per-second 200]
+                                     [--rpm 500] [--tpm 30000] [--error-rate 0.02]
+
+Point the app or the batch runner at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+and any API key. Responses are deterministic filler text sized by max_tokens
+(capped by --response-tokens), sent whole or as a server-sent event stream.
+Requests over the per-minute request or token limits get a 429 with
+Retry-After, and --error-rate of requests fail with a 500 or 503. A leading
+system message seen before is reported as cached prompt tokens, as the real
+API does for shared prefixes. GET /stats returns the request counters.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("the company offers clear value to buyers who need reliable products delivered "
+         "with care and honest advice across every market it serves").split()
+
+
+# Function to estimate tokens the way the client does (about 4 characters per token)
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+# Function to build `tokens` words of filler text, varied by the prompt so
+# different prompts get different answers
+def filler_text(prompt, tokens):
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    return " ".join(WORDS[(seed + i * 7) % len(WORDS)] for i in range(tokens))
+
+
+# Requests and tokens allowed per minute, refilled continuously
+class MinuteLimit:
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Function to take `amount`; returns 0 on success or the seconds to wait otherwise
+    def take(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.per_minute, self.available + (now - self.updated) * self.per_minute / 60)
+            self.updated = now
+            amount = min(amount, self.per_minute)
+            if self.available >= amount:
+                self.available -= amount
+                return 0
+            return (amount - self.available) * 60 / self.per_minute
+
+
+class MockOpenAI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.5, tokens_per_second=200, rpm=500, tpm=30000, error_rate=0.0,
+                 response_tokens=400, seed=0):
+        super().__init__(address, Handler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.requests = MinuteLimit(rpm)
+        self.tokens = MinuteLimit(tpm)
+        self.error_rate = error_rate
+        self.response_tokens = response_tokens
+        self.random = random.Random(seed)
+        self.prefixes = set()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "completed": 0, "rate_limited": 0, "errors": 0, "streamed": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+    def count(self, **amounts):
+        with self.lock:
+            for name, amount in amounts.items():
+                self.stats[name] += amount
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.lock:
+                self._json(200, dict(self.server.stats))
+        else:
+            self._json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "Not found"}})
+            return
+        server.count(requests=1)
+
+        messages = payload.get("messages") or []
+        prompt_text = "".join(message.get("content") or "" for message in messages)
+        prompt_tokens = estimate_tokens(prompt_text)
+
+        wait = max(server.requests.take(1), server.tokens.take(prompt_tokens))
+        if wait:
+            server.count(rate_limited=1)
+            self._json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                       {"Retry-After": f"{wait:.3f}"})
+            return
+        with server.lock:
+            failed = server.random.random() < server.error_rate
+            status = server.random.choice((500, 503))
+        if failed:
+            server.count(errors=1)
+            self._json(status, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        cached = 0
+        if len(messages) > 2 and messages[0].get("role") == "system":
+            prefix = hashlib.sha256((messages[0].get("content") or "").encode("utf-8")).hexdigest()
+            with server.lock:
+                if prefix in server.prefixes:
+                    cached = estimate_tokens(messages[0]["content"])
+                server.prefixes.add(prefix)
+
+        completion_tokens = min(max(1, payload.get("max_tokens") or server.response_tokens), server.response_tokens)
+        text = filler_text(prompt_text, completion_tokens)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        server.count(completed=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                     cached_tokens=cached)
+
+        time.sleep(server.latency)
+        if payload.get("stream"):
+            server.count(streamed=1)
+            self._stream(text, usage, payload)
+        else:
+            time.sleep(completion_tokens / server.tokens_per_second)
+            self._json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    # Function to send the response as server-sent events, a few words per event
+    # at the configured token rate
+    def _stream(self, text, usage, payload):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(data):
+            event = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(event):x}\r\n".encode("ascii") + event + b"\r\n")
+            self.wfile.flush()
+
+        words = text.split(" ")
+        for i in range(0, len(words), 8):
+            piece = " ".join(words[i:i + 8]) + (" " if i + 8 < len(words) else "")
+            send(json.dumps({"object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": piece}}]}))
+            time.sleep(len(words[i:i + 8]) / self.server.tokens_per_second)
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps({"object": "chat.completion.chunk", "choices": [], "usage": usage}))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200, help="output speed")
+    parser.add_argument("--rpm", type=int, default=500, help="requests allowed per minute")
+    parser.add_argument("--tpm", type=int, default=30000, help="prompt tokens allowed per minute")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 500/503")
+    parser.add_argument("--response-tokens", type=int, default=400, help="largest response, in tokens")
+
+
+# Function to start a server on a background thread; returns it once it is listening
+def start_server(host="127.0.0.1", port=0, **options):
+    server = MockOpenAI((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local mock of the OpenAI chat completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = MockOpenAI(
+        (args.host, args.port),
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        error_rate=args.error_rate,
+        response_tokens=args.response_tokens,
+    )
+    print(f"Mock OpenAI API on http://{args.host}:{server.server_port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
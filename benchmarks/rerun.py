@@ -0,0 +1,146 @@
+"""Rerun latency of the Streamlit app's login page.
+
+Usage:
+    python -m benchmarks.rerun [--app app.py] [--before /path/to/older/app.py] [--reruns 10]
+                               [--output benchmarks/results/rerun.json]
+
+Streamlit reruns the whole script on every widget interaction, so the work
+done at module level is paid on every keystroke. This runs the app's script
+the way the server does, with a session and a script run context, through the
+LocalScriptRunner that ships with streamlit 1.25 (the version requirements.txt
+pins). The first run is the cold start, which includes the app's imports. The
+reruns that follow reuse the session state and the server's caches. Each app
+runs in a fresh process and working folder with a placeholder API key, so no
+GPT call is made and the login page is what gets drawn.
+
+With --before, an older copy of the app (for example a `git worktree` of an
+earlier commit) is measured the same way, and both are reported side by side.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+# Function to run the app script `runs` times in this process and return the
+# milliseconds from script start to script stop of each run
+def measure(app_path, runs):
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+    from streamlit.testing.local_script_runner import LocalScriptRunner
+
+    # The parts of the server runtime a script run uses; caches live in memory as they do in the server
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    config.set_option("runner.postScriptGC", False)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(app_path)))
+
+    timings = []
+    session_state = None
+    for _ in range(runs):
+        runner = LocalScriptRunner(os.path.abspath(app_path), prev_session_state=session_state)
+        marks = {}
+
+        def on_event(sender, event, **kwargs):
+            marks.setdefault(event, time.perf_counter())
+
+        runner.on_event.connect(on_event, weak=False)
+        runner.run(timeout=120)
+        runner.join()
+        if runner.script_thread_exceptions:
+            raise runner.script_thread_exceptions[0]
+        if ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS not in marks:
+            raise RuntimeError(f"{app_path} did not run to completion: {[event.name for event in marks]}")
+        session_state = runner.session_state
+        elapsed = marks[ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS] - marks[ScriptRunnerEvent.SCRIPT_STARTED]
+        timings.append(round(elapsed * 1000, 1))
+    return timings
+
+
+# Function to measure one app in a fresh process and working folder holding
+# the app's JSON config and images and a placeholder secrets file
+def measure_app(app_path, reruns):
+    app_dir = os.path.dirname(os.path.abspath(app_path))
+    workdir = tempfile.mkdtemp(prefix="benchmark-rerun-")
+    try:
+        for path in glob.glob(os.path.join(app_dir, "*.json")) + glob.glob(os.path.join(app_dir, "*.png")):
+            shutil.copyfile(path, os.path.join(workdir, os.path.basename(path)))
+        os.makedirs(os.path.join(workdir, ".streamlit"))
+        with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w") as f:
+            f.write('[general]\nOPENAI_API_KEY = "benchmark"\n')
+
+        command = [sys.executable, "-m", "benchmarks.rerun", "measure", os.path.abspath(app_path), str(reruns + 1)]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+        completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise SystemExit(f"Measuring {app_path} failed:\n{completed.stderr}")
+        timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "app": os.path.abspath(app_path),
+        "cold_start_ms": timings[0],
+        "rerun_ms": timings[1:],
+        "rerun_median_ms": statistics.median(timings[1:]),
+    }
+
+
+def run(args):
+    try:
+        import streamlit.testing.local_script_runner  # noqa: F401
+    except ImportError:
+        raise SystemExit("streamlit 1.25 is needed (pip install streamlit==1.25.0)")
+
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "reruns": args.reruns, "apps": {}}
+    if args.before:
+        report["apps"]["before"] = measure_app(args.before, args.reruns)
+    report["apps"]["after" if args.before else "app"] = measure_app(args.app, args.reruns)
+
+    for name, result in report["apps"].items():
+        print(f"{name}: cold start {result['cold_start_ms']} ms, rerun median {result['rerun_median_ms']} ms "
+              f"({result['app']})")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"rerun-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return 0
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    # Used by `run` to measure one app in a fresh process
+    if argv[:1] == ["measure"]:
+        print(json.dumps(measure(argv[1], int(argv[2]))))
+        return 0
+
+    parser = argparse.ArgumentParser(description="Measure the rerun latency of the Streamlit app.")
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"), help="app script to measure")
+    parser.add_argument("--before", help="an older copy of the app script to compare with")
+    parser.add_argument("--reruns", type=int, default=10, help="reruns after the cold start")
+    parser.add_argument("--output", help="report path (default: benchmarks/results/rerun-<timestamp>.json)")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,325 @@
+"""Offline end-to-end benchmarks of the tab2-tab5 pipelines against a mock OpenAI server.
+
+Usage:
+    python -m benchmarks.run run [--sizes small,medium] [--latency 0.2] [--error-rate 0.02] [--stream]
+                                 [--label my-change] [--output benchmarks/results/my-change.json]
+    python -m benchmarks.run compare benchmarks/results/before.json benchmarks/results/after.json
+
+Each size gets synthetic inputs (documents with many pages, keyword exports
+with many rows), generated once and kept in .cache/benchmarks. Every size runs
+in a fresh process and working folder, so peak RSS and the caches start clean.
+A size stages the uploads, extracts the PDFs, loads and ranks the keyword
+exports, and runs tab2, tab4 and tab5 against benchmarks.mock_openai. The
+report records wall time per stage and step, PDF and CSV throughput, peak RSS,
+token usage and the server's counters, as JSON that `compare` diffs.
+The Streamlit app's rerun latency is measured by benchmarks.rerun.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, ".cache", "benchmarks")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Input sizes: pages per document, keyword exports and rows per export
+SIZES = {
+    "small": {"pages": 5, "csv_files": 3, "csv_rows": 10_000},
+    "medium": {"pages": 50, "csv_files": 3, "csv_rows": 200_000},
+    "large": {"pages": 300, "csv_files": 3, "csv_rows": 1_000_000},
+}
+
+DOCUMENTS = ("product_list", "USP", "key_stats", "about_us", "colour_scheme")
+
+
+# Function to return the folder of a size's inputs, generating them the first time
+def size_inputs(name):
+    from benchmarks.synthetic import write_company_inputs
+
+    spec = SIZES[name]
+    directory = os.path.join(DATA_DIR, f"{name}-{spec['pages']}p-{spec['csv_files']}x{spec['csv_rows']}")
+    if not os.path.exists(os.path.join(directory, "complete")):
+        shutil.rmtree(directory, ignore_errors=True)
+        write_company_inputs(directory, spec["pages"], spec["csv_files"], spec["csv_rows"])
+        open(os.path.join(directory, "complete"), "w").close()
+    return directory
+
+
+def _peak_rss_mb():
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def _server_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.load(response)
+
+
+# Function to run one size in the current process and return its results.
+# Expects to run in an empty working folder holding prompts.json, instructions.json
+# and step_profiles.json.
+def run_size(name, inputs, base_url, args):
+    from gpt_client import GPTTransport
+    from keyword_store import KeywordStore
+    from pdf_extract import page_count
+    from pipeline import Pipeline, load_documents, read_pdf, tab4_values, tab5_values, upload_path
+    from run_state import company_run_state
+    from step_graph import given_inputs, run_steps
+    from step_profiles import load_step_profiles
+
+    with open("instructions.json", "r") as f:
+        instructions = json.load(f)
+    with open("prompts.json", "r") as f:
+        prompts = json.load(f)
+    os.makedirs("uploads", exist_ok=True)
+    os.makedirs("processed", exist_ok=True)
+
+    company_name = f"bench_{name}"
+    result = {"inputs": dict(SIZES[name]), "stages": {}, "steps": {}}
+    server_before = _server_stats(base_url)
+    started = time.perf_counter()
+
+    def stage(stage_name, func):
+        stage_started = time.perf_counter()
+        value = func()
+        result["stages"][stage_name] = round(time.perf_counter() - stage_started, 3)
+        return value
+
+    # PDF extraction, cold: the text cache in this working folder starts empty
+    def pdfs():
+        pages = size = 0
+        for document in DOCUMENTS + ("pillar_page",):
+            path = upload_path(company_name, f"{document}.pdf")
+            shutil.copyfile(os.path.join(inputs, f"{document}.pdf"), path)
+            pages += page_count(path)
+            size += os.path.getsize(path)
+            read_pdf(path)
+        return pages, size
+
+    pages, pdf_bytes = stage("pdf", pdfs)
+    result["pdf"] = {
+        "pages": pages,
+        "bytes": pdf_bytes,
+        "pages_per_second": round(pages / result["stages"]["pdf"], 1),
+        "mb_per_second": round(pdf_bytes / 1e6 / result["stages"]["pdf"], 2),
+    }
+
+    store = KeywordStore(company_name)
+    csv_paths = sorted(os.path.join(inputs, file_name) for file_name in os.listdir(inputs) if file_name.endswith(".csv"))
+    stage("csv_load", lambda: [store.add_csv(path, os.path.basename(path)) for path in csv_paths])
+    stage("csv_rank", store.top_keywords)
+    stage("keyword_cluster", store.keyword_clusters_text)
+    rows = sum(member["rows"] for member in store.members)
+    result["csv"] = {
+        "rows": rows,
+        "bytes": sum(os.path.getsize(path) for path in csv_paths),
+        "load_rows_per_second": round(rows / result["stages"]["csv_load"]),
+        "rank_rows_per_second": round(rows / result["stages"]["csv_rank"]),
+    }
+
+    transport = GPTTransport(
+        api_key="benchmark",
+        base_url=base_url,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        max_concurrency=args.max_requests,
+        backoff_base=0.2,
+    )
+
+    def on_text(step_name, text):
+        pass
+
+    # Steps ask for their profile's max_tokens; the mock caps responses at --response-tokens
+    pipeline = Pipeline(company_name, prompts, instructions, transport.run_task,
+                        on_text=on_text if args.stream else None, profiles=load_step_profiles())
+    state = company_run_state(company_name)
+
+    # `values(needed)` loads the given values the tab's steps read
+    def run_tab(tab, values):
+        steps = getattr(pipeline, f"{tab}_steps")()
+        timings = result["steps"].setdefault(tab, {})
+        for step in steps:
+            step.func = _timed(step.func, step.name, timings)
+        run_steps(steps, values(given_inputs(steps)), args.step_workers, state=state)
+
+    try:
+        stage("tab2", lambda: run_tab("tab2", lambda needed: load_documents(company_name, needed)))
+        stage("tab4", lambda: run_tab("tab4", lambda needed: tab4_values(company_name, needed)))
+        stage("tab5", lambda: run_tab("tab5", lambda needed: tab5_values(
+            company_name, upload_path(company_name, "pillar_page.pdf"))))
+    finally:
+        transport.close()
+
+    result["wall_time"] = round(time.perf_counter() - started, 3)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    result["usage"] = dict(transport.usage_totals)
+    server_after = _server_stats(base_url)
+    result["server"] = {key: server_after[key] - server_before.get(key, 0) for key in server_after}
+    return result
+
+
+def _timed(func, name, timings):
+    def run(values):
+        step_started = time.perf_counter()
+        value = func(values)
+        timings[name] = round(time.perf_counter() - step_started, 3)
+        return value
+    return run
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Function to start the mock server in its own process and return (process, base_url)
+def start_mock_server(args):
+    command = [
+        sys.executable, "-m", "benchmarks.mock_openai", "--port", "0",
+        "--latency", str(args.latency),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--rpm", str(args.rpm),
+        "--tpm", str(args.tpm),
+        "--error-rate", str(args.error_rate),
+        "--response-tokens", str(args.response_tokens),
+    ]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().strip()
+    return process, line.rsplit(" ", 1)[-1]
+
+
+def run(args):
+    sizes = [name.strip() for name in args.sizes.split(",") if name.strip()]
+    unknown = [name for name in sizes if name not in SIZES]
+    if unknown:
+        raise SystemExit(f"Unknown sizes: {unknown}; choose from {sorted(SIZES)}")
+
+    label = args.label or time.strftime("%Y%m%d-%H%M%S")
+    report = {
+        "label": label,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": {key: value for key, value in vars(args).items() if key not in ("command", "func")},
+        "sizes": {},
+    }
+
+    server, base_url = start_mock_server(args)
+    try:
+        for name in sizes:
+            inputs = size_inputs(name)
+            workdir = tempfile.mkdtemp(prefix=f"benchmark-{name}-")
+            try:
+                for file_name in ("prompts.json", "instructions.json", "step_profiles.json"):
+                    shutil.copyfile(os.path.join(ROOT, file_name), os.path.join(workdir, file_name))
+                # Each size in a fresh process, so peak RSS and in-process caches start clean
+                command = [sys.executable, "-m", "benchmarks.run", "size", name, inputs, base_url,
+                           "--options", json.dumps(report["options"])]
+                env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+                completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+                if completed.returncode != 0:
+                    report["sizes"][name] = {"error": completed.stderr.strip().splitlines()[-1:]}
+                    print(completed.stderr, file=sys.stderr)
+                else:
+                    report["sizes"][name] = json.loads(completed.stdout.strip().splitlines()[-1])
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            summary = report["sizes"][name]
+            if "error" in summary:
+                print(f"{name}: failed ({summary['error']})")
+            else:
+                print(f"{name}: {summary['wall_time']}s wall, {summary['pdf']['pages_per_second']} PDF pages/s, "
+                      f"{summary['csv']['rank_rows_per_second']} CSV rows/s ranked, "
+                      f"peak RSS {summary['peak_rss_mb']['self']} MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{label}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return 1 if any("error" in summary for summary in report["sizes"].values()) else 0
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else key))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+# Function to print every numeric result two reports share, with the change between them
+def compare(args):
+    with open(args.before, "r") as f:
+        before = _flatten(json.load(f)["sizes"])
+    with open(args.after, "r") as f:
+        after = _flatten(json.load(f)["sizes"])
+    width = max((len(key) for key in before), default=0)
+    for key in sorted(set(before) & set(after)):
+        change = f"{(after[key] - before[key]) / before[key]:+.1%}" if before[key] else ""
+        print(f"{key:<{width}}  {before[key]:>14}  {after[key]:>14}  {change}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the document analysis pipeline offline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write a JSON report")
+    run_parser.add_argument("--sizes", default="small,medium", help=f"comma-separated, from {', '.join(SIZES)}")
+    run_parser.add_argument("--label", help="name of the report (default: a timestamp)")
+    run_parser.add_argument("--output", help="report path (default: benchmarks/results/<label>.json)")
+    run_parser.add_argument("--stream", action="store_true", help="stream responses as the app does")
+    run_parser.add_argument("--max-requests", type=int, default=8, help="GPT requests in flight")
+    run_parser.add_argument("--step-workers", type=int, default=4, help="steps run at the same time")
+    from benchmarks.mock_openai import add_arguments
+    add_arguments(run_parser)
+    # Faster and with higher limits than the server's own defaults, so a run measures
+    # the pipeline rather than waiting on the mock; lower them to benchmark throttling
+    run_parser.set_defaults(latency=0.2, tokens_per_second=400, rpm=5000, tpm=1_000_000)
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare)
+
+    # Used by `run` to measure one size in a fresh process
+    size_parser = subparsers.add_parser("size")
+    size_parser.add_argument("name")
+    size_parser.add_argument("inputs")
+    size_parser.add_argument("base_url")
+    size_parser.add_argument("--options", default="{}")
+    size_parser.set_defaults(func=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "size":
+        options = argparse.Namespace(**json.loads(args.options))
+        print(json.dumps(run_size(args.name, args.inputs, args.base_url, options)))
+        return 0
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import csv
+import os
+import random
+
+from benchmarks.mock_openai import WORDS
+
+LINES_PER_PAGE = 40
+WORDS_PER_LINE = 12
+
+
+# Function to escape text for a PDF string literal
+def _pdf_string(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+# Function to write a plain text PDF of `pages` pages without any PDF library.
+# Every page holds LINES_PER_PAGE lines of filler text in Helvetica, so text
+# extraction does the same work on each page.
+def write_pdf(path, pages, title="Document", seed=0):
+    rng = random.Random(seed)
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    page_ids = []
+    for page in range(pages):
+        lines = [f"{title} - page {page + 1}"]
+        lines += [" ".join(rng.choice(WORDS) for _ in range(WORDS_PER_LINE)) for _ in range(LINES_PER_PAGE)]
+        content = "BT /F1 10 Tf 14 TL 50 780 Td " + " ".join(f"({_pdf_string(line)}) '" for line in lines) + " ET"
+        content_id = 4 + 2 * page
+        page_id = content_id + 1
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content.encode("latin-1"))
+        objects[page_id] = (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(page_id)
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        " ".join(f"{page_id} 0 R" for page_id in page_ids).encode("ascii"), pages)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for object_id in sorted(objects):
+            offsets[object_id] = f.tell()
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id]))
+        xref = f.tell()
+        count = max(objects) + 1
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % count)
+        for object_id in range(1, count):
+            f.write(b"%010d 00000 n \n" % offsets[object_id])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref))
+    return path
+
+
+# Function to write a SEMrush-style keyword export of `rows` rows. Keywords
+# repeat across files built with different seeds about as often as real exports.
+def write_keyword_csv(path, rows, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Keyword", "Intent", "Volume", "Keyword Difficulty", "CPC (GBP)", "Competitive Density",
+                         "Number of Results", "Trend"])
+        for _ in range(rows):
+            keyword = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))) + f" {rng.randrange(10 ** 6)}"
+            writer.writerow([
+                keyword,
+                rng.choice(("informational", "commercial", "transactional", "navigational")),
+                int(rng.paretovariate(1.2) * 10),
+                rng.randint(0, 100),
+                f"{rng.uniform(0, 5):.2f}" if rng.random() > 0.05 else "",
+                f"{rng.random():.2f}",
+                rng.randrange(10 ** 7),
+                "0.1,0.2,0.3",
+            ])
+    return path
+
+
+# Function to create one company's uploads: the five documents with `pages`
+# pages each, a pillar page, and `csv_files` keyword exports of `csv_rows` rows
+def write_company_inputs(directory, pages, csv_files, csv_rows, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    for i, name in enumerate(("product_list", "USP", "key_stats", "about_us", "colour_scheme", "pillar_page")):
+        write_pdf(os.path.join(directory, f"{name}.pdf"), pages, title=name.replace("_", " "), seed=seed + i)
+    for i in range(csv_files):
+        write_keyword_csv(os.path.join(directory, f"keywords_{i + 1}.csv"), csv_rows, seed=seed + 100 + i)
+    return directory
@@ -0,0 +1,128 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
+
+from artifacts import ArtifactIndex
+from atomic_files import atomic_write
+from pipeline import artifact_file_names, is_tab_output
+
+# Upper bound on the zip bytes kept in memory; least recently used bundles go first
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+# Fixed timestamp for zip entries, so the same files always give the same bytes
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+# Built zip bundles keyed by the combined hash of their members
+class BundleCache:
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+_cache = BundleCache()
+
+
+# Function to hash a bundle's members from their indexed content hashes
+def bundle_key(members):
+    digest = hashlib.sha256()
+    for artifact in members:
+        digest.update(f"{artifact['file_name']}\0{artifact['hash']}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Function to zip the members in memory. Returns the zip bytes and whether every
+# member still had the content the index recorded.
+def build_zip(members):
+    buffer = io.BytesIO()
+    current = True
+    with ZipFile(buffer, "w", ZIP_DEFLATED) as zipf:
+        for artifact in members:
+            with open(artifact["path"], "rb") as f:
+                data = f.read()
+            current = current and hashlib.sha256(data).hexdigest() == artifact["hash"]
+            info = ZipInfo(artifact["file_name"], ZIP_DATE_TIME)
+            info.compress_type = ZIP_DEFLATED
+            zipf.writestr(info, data)
+    return buffer.getvalue(), current
+
+
+# Function to return a zip of the given artifacts, built only if no bundle with
+# the same member hashes is cached. A bundle read while a member was being
+# rewritten (for example by a step still streaming) is served but not cached.
+def bundle(members, cache=_cache):
+    key = bundle_key(members)
+    data = cache.get(key)
+    if data is None:
+        data, current = build_zip(members)
+        if current:
+            cache.put(key, data)
+    return data
+
+
+# Function to return a company's bundle for one tab, or of all its files when
+# `tab` is None, as (file_name, zip bytes); None when it has no such files yet.
+# The full bundle holds the files the download tab lists, without older zips.
+# With `file_names` (without the company prefix) a tab's bundle holds only those
+# of its files, for example the ones one run wrote, rather than every file of
+# the tab in processed/.
+def company_bundle(company_name, tab=None, index=None, file_names=None):
+    index = index or ArtifactIndex()
+    index.backfill(company_name, artifact_file_names())
+    if tab is None:
+        offered = index.downloads(company_name)
+        members = [artifact for artifact in index.artifacts(company_name)
+                   if artifact["file_name"] in offered and artifact["kind"] != "zip"]
+        file_name = f"{company_name}_all_outputs.zip"
+    else:
+        prefix = f"{company_name}_"
+        members = [artifact for artifact in index.artifacts(company_name)
+                   if artifact["file_name"].startswith(prefix)
+                   and is_tab_output(tab, artifact["file_name"][len(prefix):]) and os.path.exists(artifact["path"])
+                   and (file_names is None or artifact["file_name"][len(prefix):] in file_names)]
+        file_name = f"{company_name}_specific_outputs_{tab}.zip"
+    if not members:
+        return None
+    return file_name, bundle(members)
+
+
+# Function to write a company's tab bundle to processed/ as
+# {company_name}_specific_outputs_{tab}.zip, for runs outside the app (the batch
+# runner). Returns its path, or None when the tab has no such files.
+def write_company_bundle(company_name, tab, file_names=None, index=None):
+    index = index or ArtifactIndex()
+    bundle = company_bundle(company_name, tab, index, file_names)
+    if bundle is None:
+        return None
+    file_name, data = bundle
+    path = os.path.join("processed", file_name)
+    atomic_write(path, data)
+    index.record(company_name, path, "zip", content=data)
+    return path
@@ -0,0 +1,279 @@
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from pdf_cache import cached_text
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to the 4-characters-per-token estimate
+    tiktoken = None
+
+CACHE_DIR = os.path.join(".cache", "condensed")
+
+# Prompt budget (instructions + prompt, in tokens) for steps without their own;
+# leaves room for the response within gpt-4o's 128k context
+DEFAULT_TOKEN_BUDGET = 100_000
+
+# Size of the pieces a long document is cut into before condensing
+CHUNK_TOKENS = 4_000
+
+# Condensed targets are rounded up to this, so steps with similar budgets share cache entries
+TARGET_STEP = 1_000
+
+# Passes of map-reduce before giving up on reaching the target
+MAX_ROUNDS = 3
+
+# Share of the default budget the shared company context block may take
+BLOCK_SHARE = 0.6
+
+# Values that can be condensed when a prompt is over budget: the uploaded company
+# documents, in the order they appear in the shared company context block
+CONDENSABLE = ("product_list", "USP", "key_stats", "about_us")
+
+DOCUMENT_TITLES = {
+    "product_list": "Product List",
+    "USP": "USP",
+    "key_stats": "Key Stats",
+    "about_us": "About Us",
+}
+
+
+# Function to return the text a prompt uses in place of a document held in the company context block
+def document_reference(document_name):
+    return f"[the {DOCUMENT_TITLES[document_name]} document in the company documents above]"
+
+
+_encoding = None
+
+
+# Function to count the tokens in a text with the gpt-4o tokenizer when available
+def count_tokens(text):
+    global _encoding
+    if tiktoken is None:
+        return len(text) // 4
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+# Function to cut a text into pieces of at most `max_tokens`, at paragraph
+# boundaries where possible and at line or sentence boundaries otherwise
+def split_text(text, max_tokens=CHUNK_TOKENS):
+    pieces = []
+    for paragraph in re.split(r"(\n\s*\n)", text):
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r"(?<=[.!?\n])\s+", paragraph):
+            while count_tokens(sentence) > max_tokens:
+                cut = max_tokens * 4
+                pieces.append(sentence[:cut])
+                sentence = sentence[cut:]
+            pieces.append(sentence + " ")
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append("".join(current))
+            current = []
+            current_tokens = 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+# Function to cut a document into chunks of paragraphs for editing piece by
+# piece. A chunk ends before a heading, or after a paragraph whose hash picks it
+# as a boundary, once it holds `min_tokens`; it never grows past `max_tokens`.
+# Boundaries depend on the paragraphs around them rather than on the document
+# as a whole, so after a small edit every chunk away from it comes out the same.
+# Chunks joined with blank lines give back the document's paragraphs.
+def split_document(text, max_tokens=1_200, min_tokens=300):
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        if paragraph.strip():
+            paragraphs.extend(
+                [paragraph] if count_tokens(paragraph) <= max_tokens else split_text(paragraph, max_tokens)
+            )
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in paragraphs:
+        tokens = count_tokens(paragraph)
+        heading = paragraph.lstrip().startswith("#")
+        if current and (current_tokens + tokens > max_tokens or (heading and current_tokens >= min_tokens)):
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+        current.append(paragraph)
+        current_tokens += tokens
+        if current_tokens >= min_tokens and hashlib.sha256(paragraph.encode("utf-8")).digest()[0] % 4 == 0:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_tokens = 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+# Fits the documents of each step's prompt into a per-step token budget. When a
+# prompt is over budget the largest company documents are condensed with a
+# chunked map-reduce pass (chunks condensed in parallel, then joined and condensed
+# again if still too long). Condensed forms are cached on disk per document hash
+# and target size, so every step with a similar budget reuses the same text.
+class ContextBuilder:
+    def __init__(self, company_name, prompts, instructions, run_task, budgets=None,
+                 default_budget=DEFAULT_TOKEN_BUDGET, max_workers=4, condense_options=None):
+        self.company_name = company_name
+        self.prompts = prompts
+        self.instructions = instructions
+        self.run_task = run_task
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+        self.max_workers = max_workers
+        # Extra run_task arguments (model, max_tokens, ...) of the condensing calls
+        self.condense_options = condense_options or {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._blocks = {}
+        self._block_tokens = {}
+
+    def budget(self, step_name):
+        return self.budgets.get(step_name, self.default_budget)
+
+    # Function to return the prompt fields with documents condensed as needed so
+    # the formatted prompt and instructions fit the step's budget. With `context`,
+    # the company block sent ahead of them, its tokens come out of the budget first.
+    def fit(self, step_name, template, instructions, fields, context=None):
+        budget = self.budget(step_name)
+        if context:
+            budget -= self.block_tokens(context)
+        if count_tokens(instructions) + count_tokens(template.format(**fields)) <= budget:
+            return fields
+
+        sizes = {name: count_tokens(fields[name]) for name in CONDENSABLE if fields.get(name)}
+        fixed = count_tokens(instructions) + count_tokens(template.format(**{
+            name: "" if name in sizes else value for name, value in fields.items()
+        }))
+        targets = _share_budget(sizes, budget - fixed)
+
+        fitted = dict(fields)
+        for name, target in targets.items():
+            if sizes[name] > target:
+                fitted[name] = self.condense(name, fields[name], target)
+        return fitted
+
+    # Function to build the company context block shared by every step that reads
+    # the documents. The same documents always give byte-identical text, so it
+    # forms a common prompt prefix; documents are condensed if the block would
+    # take more than BLOCK_SHARE of the default budget, or more than `max_tokens`.
+    def company_block(self, documents, max_tokens=None):
+        available = int(self.default_budget * BLOCK_SHARE)
+        if max_tokens is not None:
+            available = min(available, max_tokens)
+        key = hashlib.sha256(
+            repr([documents.get(name, "") for name in CONDENSABLE] + [available]).encode("utf-8")
+        ).hexdigest()
+        with self._locks_lock:
+            if key in self._blocks:
+                return self._blocks[key]
+
+        sizes = {name: count_tokens(documents[name]) for name in CONDENSABLE if documents.get(name)}
+        targets = _share_budget(sizes, available)
+        sections = [f"Company documents for {self.company_name}. Later messages refer to these documents by name."]
+        for name in CONDENSABLE:
+            text = documents.get(name, "")
+            if name in sizes and sizes[name] > targets[name]:
+                text = self.condense(name, text, targets[name])
+            sections.append(f"## {DOCUMENT_TITLES[name]}\n\n{text}")
+        block = "\n\n".join(sections)
+
+        with self._locks_lock:
+            self._blocks[key] = block
+        return block
+
+    # Function to return the company block for a step whose prompt refers to it:
+    # the shared block, or when that and the step's instructions and prompt would
+    # exceed its budget, a block condensed to fit what they leave
+    def step_block(self, step_name, template, instructions, fields, documents):
+        block = self.company_block(documents)
+        room = self.budget(step_name) - count_tokens(instructions) - count_tokens(template.format(**fields))
+        if self.block_tokens(block) <= room:
+            return block
+        return self.company_block(documents, room)
+
+    # Function to count the tokens of a company block, once per block
+    def block_tokens(self, block):
+        with self._locks_lock:
+            tokens = self._block_tokens.get(block)
+        if tokens is None:
+            tokens = count_tokens(block)
+            with self._locks_lock:
+                self._block_tokens[block] = tokens
+        return tokens
+
+    # Function to condense one document to about `target` tokens, cached per content and target
+    def condense(self, document_name, text, target):
+        target = max(TARGET_STEP, -(-target // TARGET_STEP) * TARGET_STEP)
+        key = f"{hashlib.sha256(text.encode('utf-8')).hexdigest()}_{target}"
+
+        # Steps running at the same time wait for one condensing pass instead of repeating it
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            return cached_text(CACHE_DIR, key, lambda: self._map_reduce(document_name, text, target))
+
+    def _map_reduce(self, document_name, text, target):
+        for _ in range(MAX_ROUNDS):
+            tokens = count_tokens(text)
+            if tokens <= target:
+                break
+            chunks = split_text(text, CHUNK_TOKENS)
+            # Each chunk gets its share of the target, in words (about 0.75 per token)
+            chunk_words = max(50, int(target * 0.75 / len(chunks)))
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # Bound to the calling step, so the condensing calls count towards its metrics
+                condensed = list(executor.map(
+                    metrics.bound(lambda chunk: self._condense_chunk(document_name, chunk, chunk_words)),
+                    chunks,
+                ))
+            text = "\n\n".join(condensed)
+        return text
+
+    def _condense_chunk(self, document_name, chunk, target_words):
+        prompt = self.prompts["prompt_condense_document"].format(
+            company_name=self.company_name,
+            document_name=document_name.replace("_", " "),
+            target_words=target_words,
+            document_chunk=chunk,
+        )
+        return self.run_task(self.instructions["condense"], prompt, **self.condense_options)
+
+
+# Function to split `available` tokens between documents: documents smaller than
+# an equal share keep their size and the rest share what is left
+def _share_budget(sizes, available):
+    targets = {}
+    remaining = dict(sizes)
+    available = max(available, TARGET_STEP * max(1, len(sizes)))
+    while remaining:
+        share = available // len(remaining)
+        small = {name: size for name, size in remaining.items() if size <= share}
+        if not small:
+            targets.update({name: share for name in remaining})
+            break
+        for name, size in small.items():
+            targets[name] = size
+            available -= size
+            del remaining[name]
+    return targets
@@ -0,0 +1,334 @@
+import asyncio
+import email.utils
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+
+import httpx
+
+import metrics
+from response_cache import request_key
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+DEFAULT_MODEL = "gpt-4o"
+
+# Response limit for calls that do not set their own (step_profiles.json sets one per step)
+DEFAULT_MAX_TOKENS = 4096
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Result of one chat completion: the text, the raw usage dict, retries it took,
+# seconds spent, whether it came from the response cache and the seconds of
+# those spent waiting on the rate limits and retry backoff
+Completion = namedtuple("Completion", ["text", "usage", "retries", "seconds", "cached", "waited"],
+                        defaults=[False, 0.0])
+
+
+# Raised when a request fails for good: non-retryable status, retries used up or deadline passed
+class GPTRequestError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class _RetryableError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+# Token bucket refilled continuously at `per_minute / 60` units a second.
+# Used for both requests per minute (one unit per call) and tokens per minute.
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Wait until `amount` units are available and take them. Requests larger than
+    # the whole bucket are capped so they can still go through on a full bucket.
+    async def acquire(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    # Correct an earlier estimate once the real usage is known (negative refunds)
+    def adjust(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+# Function to read a Retry-After (or retry-after-ms) header as seconds
+def parse_retry_after(headers):
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        if parsed is None:
+            return None
+        return max(0.0, parsed.timestamp() - time.time())
+
+
+# Function to guess the tokens a request will use before it is sent (about 4 characters per token)
+def estimate_tokens(*texts):
+    return sum(len(text) for text in texts) // 4
+
+
+# Function to read the prompt tokens served from the provider's prompt cache
+def cached_tokens(usage):
+    return (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+
+# Asynchronous OpenAI chat transport sharing one pooled HTTP client. Requests and
+# tokens per minute are limited with token buckets, transient failures are retried
+# with jittered exponential backoff that honours Retry-After, and every call has a
+# deadline covering all of its attempts. `base_url` can point at a local stand-in
+# server for testing.
+#
+# The transport owns an event loop on a background thread, so synchronous callers
+# (Streamlit, the step graph's worker threads) share the same pool and limits
+# through run_task().
+class GPTTransport:
+    def __init__(
+        self,
+        api_key,
+        base_url=None,
+        requests_per_minute=500,
+        tokens_per_minute=30000,
+        max_concurrency=8,
+        max_connections=20,
+        max_retries=5,
+        timeout=120.0,
+        backoff_base=1.0,
+        backoff_max=60.0,
+        cache=None,
+    ):
+        self.api_key = api_key
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache = cache
+
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._start_lock = threading.Lock()
+        self.usage_totals = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+    # Function to start the background event loop and the pooled client on first use
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="gpt-transport", daemon=True)
+            thread.start()
+            self._loop = loop
+            self._thread = thread
+            asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+
+    async def _setup(self):
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+        )
+        self._requests = TokenBucket(self.requests_per_minute)
+        self._tokens = TokenBucket(self.tokens_per_minute)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _backoff(self, attempt, retry_after):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _check_status(self, response, text):
+        if response.status_code in RETRYABLE_STATUS:
+            raise _RetryableError(
+                f"HTTP {response.status_code}: {text[:200]}",
+                status=response.status_code,
+                retry_after=parse_retry_after(response.headers),
+            )
+        if response.status_code >= 400:
+            raise GPTRequestError(f"HTTP {response.status_code}: {text[:500]}", status=response.status_code)
+
+    # Function to send a request and return (text, usage)
+    async def _send(self, payload):
+        try:
+            response = await self._client.post("/chat/completions", json=payload)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            raise _RetryableError(f"{type(e).__name__}: {e}") from e
+
+        self._check_status(response, response.text)
+        body = response.json()
+        return body["choices"][0]["message"]["content"], body.get("usage") or {}
+
+    # Function to send a streaming request, passing each text delta to `on_text` as
+    # it arrives, and return (text, usage). Only failures before the first delta are
+    # retried, since the caller has already seen the partial text after that.
+    async def _send_stream(self, payload, on_text):
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        parts = []
+        usage = {}
+        try:
+            async with self._client.stream("POST", "/chat/completions", json=payload) as response:
+                if response.status_code >= 400:
+                    body = (await response.aread()).decode("utf-8", "replace")
+                    self._check_status(response, body)
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if chunk.get("usage"):
+                        usage = chunk["usage"]
+                    for choice in chunk.get("choices") or []:
+                        delta = (choice.get("delta") or {}).get("content")
+                        if delta:
+                            parts.append(delta)
+                            on_text(delta)
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            if parts:
+                raise GPTRequestError(f"Stream interrupted after partial output: {type(e).__name__}: {e}") from e
+            raise _RetryableError(f"{type(e).__name__}: {e}") from e
+        return "".join(parts), usage
+
+    # Function to add a response's usage to the running totals, including the
+    # prompt tokens the provider served from its prompt cache
+    def _record_usage(self, usage):
+        totals = self.usage_totals
+        totals["requests"] += 1
+        totals["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        totals["completion_tokens"] += usage.get("completion_tokens", 0)
+        totals["cached_tokens"] += cached_tokens(usage)
+
+    # Send one chat completion and return a Completion. `use_cache=False` skips the
+    # response cache entirely; `refresh=True` ignores a cached answer but stores the new one.
+    # With `on_text` the response is streamed and each text delta passed to it as it
+    # arrives (a cached answer is passed in one piece). `on_text` runs on the
+    # transport's loop thread, so it must be quick and thread-safe.
+    # `context` is sent as a leading system message ahead of the instructions, so
+    # requests sharing it share a prefix the provider can cache.
+    async def complete(self, instructions, prompt, model=DEFAULT_MODEL, max_tokens=DEFAULT_MAX_TOKENS, timeout=None,
+                       use_cache=True, refresh=False, on_text=None, context=None, **params):
+        messages = [
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": prompt},
+        ]
+        if context:
+            messages.insert(0, {"role": "system", "content": context})
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            **params,
+        }
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        key = None
+        if self.cache is not None and use_cache:
+            key = request_key(payload)
+            if not refresh:
+                hit = await loop.run_in_executor(None, self.cache.get, key)
+                if hit is not None:
+                    if on_text is not None:
+                        on_text(hit[0])
+                    return Completion(hit[0], hit[1], 0, loop.time() - started, True)
+
+        deadline = started + (timeout or self.timeout)
+        estimated = estimate_tokens(instructions, prompt, context or "") + max_tokens
+
+        attempt = 0
+        waited = 0.0
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise GPTRequestError(f"Deadline of {timeout or self.timeout}s exceeded after {attempt} attempts")
+            try:
+                wait_started = loop.time()
+                async with self._semaphore:
+                    await asyncio.wait_for(self._requests.acquire(1), remaining)
+                    await asyncio.wait_for(self._tokens.acquire(estimated), deadline - loop.time())
+                    waited += loop.time() - wait_started
+                    if on_text is None:
+                        send = self._send(payload)
+                    else:
+                        send = self._send_stream(payload, on_text)
+                    text, usage = await asyncio.wait_for(send, deadline - loop.time())
+            except asyncio.TimeoutError:
+                raise GPTRequestError(f"Deadline of {timeout or self.timeout}s exceeded after {attempt + 1} attempts")
+            except _RetryableError as e:
+                if attempt >= self.max_retries:
+                    raise GPTRequestError(f"Giving up after {attempt + 1} attempts: {e}", status=e.status) from e
+                delay = self._backoff(attempt, e.retry_after)
+                if loop.time() + delay >= deadline:
+                    raise GPTRequestError(f"Deadline would pass before retrying: {e}", status=e.status) from e
+                attempt += 1
+                waited += delay
+                await asyncio.sleep(delay)
+                continue
+
+            if "total_tokens" in usage:
+                self._tokens.adjust(usage["total_tokens"] - estimated)
+            self._record_usage(usage)
+            if key is not None:
+                await loop.run_in_executor(None, self.cache.put, key, text, usage)
+            return Completion(text, usage, attempt, loop.time() - started, False, waited)
+
+    # Function to run a coroutine on the transport's loop from synchronous code
+    def run(self, coro):
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    # Synchronous entry point used by run_gpt_task and the step graph. The
+    # completion's usage is added to the metrics of the step calling it.
+    def run_task(self, instructions, prompt, **kwargs):
+        completion = self.run(self.complete(instructions, prompt, **kwargs))
+        metrics.record_completion(completion, kwargs.get("model", DEFAULT_MODEL))
+        return completion.text
+
+    # Function to close the pooled client and stop the background loop
+    def close(self):
+        if self._loop is None:
+            return
+        self.run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
@@ -0,0 +1,386 @@
+"""Background jobs: a SQLite queue of pipeline runs and the worker that executes them.
+
+Usage:
+    python jobs.py worker [--jobs 4] [--step-workers 4]
+
+The Streamlit app submits a job per tab run (tab2, tab4 or tab5 for one
+company) and starts a worker process on first use; more workers can be
+started by hand and share the same queue. Each job records its status and the
+status and text of every step, so the app only polls the queue and a page
+refresh does not lose a run. Jobs of one company run one at a time, in the
+order they were submitted; jobs of different companies run concurrently.
+A job whose worker stops sending heartbeats is queued again and resumes from
+its run state.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from artifact_store import default_store
+from gpt_client import GPTTransport
+from metrics import RunMetrics
+from pipeline import DOCUMENT_FILES, Pipeline, load_documents, step_file, tab4_values, tab5_values
+from response_cache import ResponseCache
+from run_state import company_run_state
+from sqlite_db import connect
+from step_graph import given_inputs, run_steps
+from step_profiles import load_step_profiles
+
+JOB_DB = os.path.join("processed", ".jobs", "jobs.sqlite")
+
+# Tabs a job can run, in pipeline order
+TABS = ("tab2", "tab4", "tab5")
+
+ACTIVE = ("queued", "running")
+
+HEARTBEAT_SECONDS = 5
+
+# A running job without a heartbeat for this long is assumed lost and queued again
+STALE_SECONDS = 60
+
+# How often the worker looks for new jobs
+POLL_SECONDS = 1
+
+# Streamed step text is written to the queue at most this often per step
+TEXT_FLUSH_SECONDS = 0.5
+
+
+# Pipeline runs waiting, running or finished, shared by the app and every worker
+class JobQueue:
+    def __init__(self, path=JOB_DB):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " company_name TEXT NOT NULL,"
+                " tab TEXT NOT NULL,"
+                " params TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " error TEXT,"
+                " result TEXT,"
+                " worker TEXT,"
+                " created REAL NOT NULL,"
+                " started REAL,"
+                " finished REAL,"
+                " heartbeat REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_company ON jobs (company_name, tab, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_steps ("
+                " job_id INTEGER NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " step TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " text TEXT NOT NULL DEFAULT '',"
+                " output TEXT,"
+                " PRIMARY KEY (job_id, step))"
+            )
+            # Databases created before steps recorded their output file
+            if "output" not in {row["name"] for row in conn.execute("PRAGMA table_info(job_steps)")}:
+                conn.execute("ALTER TABLE job_steps ADD COLUMN output TEXT")
+
+    # Function to queue a tab run for a company. If the same run is already
+    # queued or running its id is returned instead of queueing it twice.
+    def submit(self, company_name, tab, params=None):
+        if tab not in TABS:
+            raise ValueError(f"Unknown tab: {tab}")
+        with connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE company_name = ? AND tab = ? AND status IN (?, ?) ORDER BY id DESC LIMIT 1",
+                (company_name, tab, *ACTIVE),
+            ).fetchone()
+            if row is not None:
+                return row["id"]
+            cursor = conn.execute(
+                "INSERT INTO jobs (company_name, tab, params, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                (company_name, tab, json.dumps(params or {}), time.time()),
+            )
+            return cursor.lastrowid
+
+    # Function to take the oldest queued job of a company with nothing running,
+    # first returning jobs of workers that stopped sending heartbeats to the queue
+    def claim(self, worker):
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat < ?",
+                (now - STALE_SECONDS,),
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND company_name NOT IN"
+                " (SELECT company_name FROM jobs WHERE status = 'running') ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ? WHERE id = ?",
+                (worker, now, now, row["id"]),
+            )
+            return _job(row)
+
+    def heartbeat(self, job_ids):
+        with connect(self.path) as conn:
+            conn.executemany("UPDATE jobs SET heartbeat = ? WHERE id = ?", [(time.time(), job_id) for job_id in job_ids])
+
+    # Function to list a job's steps as pending before it starts, with the file
+    # in processed/ (without the company prefix) each one writes, from `outputs`
+    def set_steps(self, job_id, step_names, outputs=None):
+        outputs = outputs or {}
+        with connect(self.path) as conn:
+            conn.execute("DELETE FROM job_steps WHERE job_id = ?", (job_id,))
+            conn.executemany(
+                "INSERT INTO job_steps (job_id, position, step, status, output) VALUES (?, ?, ?, 'pending', ?)",
+                [(job_id, position, name, outputs.get(name)) for position, name in enumerate(step_names)],
+            )
+
+    def update_step(self, job_id, step_name, status=None, text=None):
+        with connect(self.path) as conn:
+            if status is not None:
+                conn.execute("UPDATE job_steps SET status = ? WHERE job_id = ? AND step = ?", (status, job_id, step_name))
+            if text is not None:
+                conn.execute("UPDATE job_steps SET text = ? WHERE job_id = ? AND step = ?", (text, job_id, step_name))
+
+    def finish(self, job_id, result=None, error=None):
+        with connect(self.path) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                ("failed" if error else "done", json.dumps(result or {}), error, time.time(), job_id),
+            )
+
+    def job(self, job_id):
+        with connect(self.path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row is not None else None
+
+    # Function to return the most recent job of a company's tab, or None
+    def latest(self, company_name, tab):
+        with connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE company_name = ? AND tab = ? ORDER BY id DESC LIMIT 1",
+                (company_name, tab),
+            ).fetchone()
+        return _job(row) if row is not None else None
+
+    def steps(self, job_id):
+        with connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT step, status, text, output FROM job_steps WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    # Function to count queued and running jobs, for the app's status line
+    def counts(self):
+        with connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS n FROM jobs WHERE status IN (?, ?) GROUP BY status", ACTIVE
+            ).fetchall()
+        counts = dict.fromkeys(ACTIVE, 0)
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+
+def _job(row):
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+# Function to run one job: build the tab's steps, run them with the company's
+# run state and report each step's status and streamed text to the queue. The
+# optional "outputs" param lists the outputs to produce (see Pipeline._requested);
+# only the documents their steps read are parsed. The run's metrics are saved
+# under "job-<id>" whether it succeeds or not.
+def run_job(job_queue, job, prompts, instructions, run_task, max_workers, profiles=None):
+    job_id = job["id"]
+    company_name = job["company_name"]
+    tab = job["tab"]
+    params = job["params"]
+
+    texts = {}
+    flushed = {}
+    lock = threading.Lock()
+
+    # Called by the pipeline's stream threads, off the transport's loop, so the
+    # queue write below never holds up other requests
+    def on_text(step_name, text):
+        with lock:
+            texts[step_name] = texts.get(step_name, "") + text
+            if time.monotonic() - flushed.get(step_name, 0) < TEXT_FLUSH_SECONDS:
+                return
+            flushed[step_name] = time.monotonic()
+            content = texts[step_name]
+        job_queue.update_step(job_id, step_name, text=content)
+
+    pipeline = Pipeline(company_name, prompts, instructions, run_task, refresh=params.get("refresh", ()), on_text=on_text,
+                        profiles=profiles)
+    # Only the steps the requested outputs need (by default the tab's files) run
+    outputs = params.get("outputs")
+    if tab == "tab5" and params.get("pillar_pages"):
+        steps = pipeline.tab5_steps(params["pillar_pages"], outputs)
+    else:
+        steps = getattr(pipeline, f"{tab}_steps")(outputs=outputs)
+    needed = given_inputs(steps)
+
+    # Wrap each step so the queue shows when it starts, finishes or fails
+    def tracked(step):
+        func = step.func
+
+        def run(values):
+            job_queue.update_step(job_id, step.name, status="running")
+            try:
+                value = func(values)
+            except Exception:
+                job_queue.update_step(job_id, step.name, status="failed")
+                raise
+            job_queue.update_step(job_id, step.name, status="done", text=value)
+            return value
+        return run
+
+    for step in steps:
+        step.func = tracked(step)
+    job_queue.set_steps(job_id, [step.name for step in steps],
+                        {step.name: step_file(company_name, step) for step in steps})
+
+    run_metrics = RunMetrics(company_name, tab, run_id=f"job-{job_id}")
+    status = "failed"
+    try:
+        # PDFs parsed while gathering the inputs count towards the run
+        with run_metrics.active():
+            if tab == "tab2":
+                values = load_documents(company_name, needed)
+                missing = [file_name for name, file_name in DOCUMENT_FILES.items() if name in needed and name not in values]
+                if missing:
+                    raise FileNotFoundError(f"Missing documents: {', '.join(missing)}")
+            elif tab == "tab4":
+                values = tab4_values(company_name, needed)
+            else:
+                values = tab5_values(company_name, params.get("pillar_page_path"), params.get("pillar_pages"))
+
+        state = company_run_state(company_name)
+        values = run_steps(steps, values, max_workers, state=state, metrics=run_metrics)
+        # Outputs are written behind the run; the job is done once they are on disk
+        default_store().flush()
+        status = "done"
+    finally:
+        run_metrics.save(status)
+    for name in state.skipped:
+        job_queue.update_step(job_id, name, status="reused", text=values[name])
+    return {"reused_steps": state.skipped, "ran_steps": state.ran, "metrics": run_metrics.summary()}
+
+
+# Runs up to `max_jobs` jobs at the same time on threads sharing one transport,
+# sending heartbeats for them until `stop` is set
+class Worker:
+    def __init__(self, job_queue, transport, prompts, instructions, max_jobs=4, step_workers=4, profiles=None):
+        self.job_queue = job_queue
+        self.transport = transport
+        self.prompts = prompts
+        self.instructions = instructions
+        self.profiles = profiles
+        self.max_jobs = max_jobs
+        self.step_workers = step_workers
+        self.name = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.running = {}
+        self.stop = threading.Event()
+
+    def _run(self, job):
+        try:
+            result = run_job(self.job_queue, job, self.prompts, self.instructions,
+                             self.transport.run_task, self.step_workers, self.profiles)
+            self.job_queue.finish(job["id"], result=result)
+        except Exception as e:
+            traceback.print_exc()
+            self.job_queue.finish(job["id"], error=f"{type(e).__name__}: {e}")
+        finally:
+            self.running.pop(job["id"], None)
+
+    def run(self, should_stop=lambda: False):
+        last_heartbeat = 0
+        while not self.stop.is_set() and not should_stop():
+            if time.monotonic() - last_heartbeat >= HEARTBEAT_SECONDS and self.running:
+                self.job_queue.heartbeat(list(self.running))
+                last_heartbeat = time.monotonic()
+            while len(self.running) < self.max_jobs:
+                job = self.job_queue.claim(self.name)
+                if job is None:
+                    break
+                thread = threading.Thread(target=self._run, args=(job,), daemon=True)
+                self.running[job["id"]] = thread
+                thread.start()
+            self.stop.wait(POLL_SECONDS)
+
+        # Let the jobs in flight finish, still sending heartbeats
+        while self.running:
+            self.job_queue.heartbeat(list(self.running))
+            for thread in list(self.running.values()):
+                thread.join(HEARTBEAT_SECONDS)
+
+
+# Function to start a worker process for the app, stopping when the app's process exits
+def spawn_worker(api_key, base_url=None, max_jobs=4, log_path=None):
+    env = dict(os.environ, OPENAI_API_KEY=api_key)
+    if base_url:
+        env["OPENAI_BASE_URL"] = base_url
+    # With `log_path` the worker's output is appended there, so the reason it exited can be shown
+    log = open(log_path, "ab") if log_path else None
+    try:
+        return subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "worker", "--jobs", str(max_jobs), "--parent", str(os.getpid())],
+            env=env, stdout=log, stderr=log,
+        )
+    finally:
+        if log is not None:
+            log.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run queued pipeline jobs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="run jobs from the queue")
+    worker_parser.add_argument("--jobs", type=int, default=4, help="jobs run at the same time")
+    worker_parser.add_argument("--step-workers", type=int, default=4, help="steps run at the same time within a job")
+    worker_parser.add_argument("--parent", type=int, help="exit once this process has exited")
+    worker_parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"))
+    worker_parser.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL"))
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("API key not found. Pass --api-key or set the OPENAI_API_KEY environment variable.")
+
+    with open("instructions.json", "r") as f:
+        instructions = json.load(f)
+    with open("prompts.json", "r") as f:
+        prompts = json.load(f)
+    profiles = load_step_profiles()
+    os.makedirs("processed", exist_ok=True)
+
+    transport = GPTTransport(api_key=args.api_key, base_url=args.base_url, cache=ResponseCache())
+    worker = Worker(JobQueue(), transport, prompts, instructions, args.jobs, args.step_workers, profiles)
+
+    def parent_exited():
+        return args.parent is not None and os.getppid() != args.parent
+
+    try:
+        worker.run(should_stop=parent_exited)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        transport.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
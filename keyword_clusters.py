@@ -0,0 +1,190 @@
+import zlib
+
+import numpy as np
+import pandas as pd
+
+# Keywords are compared on their character trigrams (words padded with spaces),
+# hashed into this many features so memory does not grow with the vocabulary
+NGRAM = 3
+FEATURES = 1 << 12
+
+# Cosine similarity a keyword needs with a cluster's lead keyword to join it
+SIMILARITY = 0.45
+
+# Rows (and columns) of the similarity matrix computed at a time; memory stays
+# flat for thousands of keywords
+BLOCK_ROWS = 512
+
+# Keywords listed per cluster in the prompt summary; the rest are counted. Well
+# above what the top keywords give a cluster, so it only trims very large lists.
+MAX_MEMBERS = 50
+
+
+# Function to return the hashed trigram features of a keyword. crc32 keeps the
+# features the same between processes, unlike hash().
+def _features(keyword):
+    text = f" {' '.join(str(keyword).lower().split())} "
+    return [zlib.crc32(text[i:i + NGRAM].encode("utf-8")) % FEATURES for i in range(len(text) - NGRAM + 1)]
+
+
+# Function to build the TF-IDF vectors of the keywords (sublinear term frequency
+# and smoothed IDF, L2-normalised, so a dot product of two rows gives their cosine
+# similarity). Rows are sparse, as (indptr, features, weights): row i holds
+# features[indptr[i]:indptr[i + 1]], so memory grows with the trigrams rather
+# than with keywords times FEATURES.
+def keyword_vectors(keywords):
+    rows = []
+    columns = []
+    for row, keyword in enumerate(keywords):
+        features = _features(keyword)
+        rows.extend([row] * len(features))
+        columns.extend(features)
+
+    # Distinct (row, feature) pairs in row order, with how often each occurs
+    pairs, counts = np.unique(np.asarray(rows, dtype=np.int64) * FEATURES + np.asarray(columns, dtype=np.int64),
+                              return_counts=True)
+    rows = pairs // FEATURES
+    features = (pairs % FEATURES).astype(np.intp)
+
+    document_counts = np.bincount(features, minlength=FEATURES)
+    idf = (np.log((1 + len(keywords)) / (1 + document_counts)) + 1).astype(np.float32)
+    weights = (1 + np.log(counts.astype(np.float32))) * idf[features]
+    norms = np.sqrt(np.bincount(rows, weights=weights.astype(np.float64) ** 2, minlength=len(keywords)))
+    weights /= np.maximum(norms, 1e-12).astype(np.float32)[rows]
+
+    indptr = np.zeros(len(keywords) + 1, dtype=np.intp)
+    np.cumsum(np.bincount(rows, minlength=len(keywords)), out=indptr[1:])
+    return indptr, features, weights
+
+
+# Function to expand the given rows of the sparse vectors into a dense block
+def _dense(vectors, rows):
+    indptr, features, weights = vectors
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    block_rows = np.repeat(np.arange(len(rows)), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)
+    block = np.zeros((len(rows), FEATURES), dtype=np.float32)
+    block[block_rows, features[positions]] = weights[positions]
+    return block
+
+
+# Function to yield the cosine similarities of `rows` with `columns` (row
+# numbers), BLOCK_ROWS columns at a time, as (start, block): only blocks of
+# BLOCK_ROWS rows are ever dense
+def _similarities(vectors, rows, columns):
+    left = _dense(vectors, rows)
+    for start in range(0, len(columns), BLOCK_ROWS):
+        yield start, left @ _dense(vectors, columns[start:start + BLOCK_ROWS]).T
+
+
+# Function to pick the lead keywords: taken in `order`, a keyword leads a new
+# cluster unless a lead before it is at least `threshold` similar to it.
+# Similarities are computed BLOCK_ROWS leads at a time, only against the
+# keywords not yet covered.
+def _leads(vectors, order, threshold):
+    covered = np.zeros(len(vectors[0]) - 1, dtype=bool)
+    leads = []
+    for start in range(0, len(order), BLOCK_ROWS):
+        block = order[start:start + BLOCK_ROWS]
+        block = block[~covered[block]]
+        if not len(block):
+            continue
+        open_rows = np.flatnonzero(~covered)
+        similar = np.empty((len(block), len(open_rows)), dtype=bool)
+        for column, similarity in _similarities(vectors, block, open_rows):
+            similar[:, column:column + similarity.shape[1]] = similarity >= threshold
+        for position, row in enumerate(block):
+            if covered[row]:
+                continue
+            leads.append(row)
+            covered[row] = True
+            covered[open_rows[similar[position]]] = True
+    return np.asarray(leads, dtype=np.intp)
+
+
+# Function to group keywords into clusters of similar spelling. Each keyword joins
+# the lead it is most similar to; leads are picked best first, by Score when the
+# frame has one, else by Volume, else in row order. Returns the frame with a
+# "Cluster" column holding the lead keyword of each row.
+def cluster_keywords(frame, threshold=SIMILARITY):
+    frame = frame.reset_index(drop=True)
+    if frame.empty:
+        return frame.assign(Cluster=pd.Series(dtype="string"))
+
+    keywords = frame["Keyword"].astype("string").fillna("").to_list()
+    vectors = keyword_vectors(keywords)
+    rank_column = next((column for column in ("Score", "Volume") if column in frame), None)
+    if rank_column is None:
+        order = np.arange(len(frame))
+    else:
+        order = np.argsort(-frame[rank_column].fillna(0).to_numpy(dtype=np.float64), kind="stable")
+    leads = _leads(vectors, order, threshold)
+
+    assigned = np.empty(len(frame), dtype=np.intp)
+    for start in range(0, len(frame), BLOCK_ROWS):
+        rows = np.arange(start, min(start + BLOCK_ROWS, len(frame)))
+        best = np.full(len(rows), -np.inf, dtype=np.float32)
+        for column, similarity in _similarities(vectors, rows, leads):
+            # The first lead wins ties, as with argmax over all leads at once
+            block_best = similarity.max(axis=1)
+            better = block_best > best
+            best[better] = block_best[better]
+            assigned[rows[better]] = leads[column + np.argmax(similarity[better], axis=1)]
+    # A lead always stays in its own cluster, even when another lead spells the same
+    assigned[leads] = leads
+
+    return frame.assign(Cluster=frame["Keyword"].to_numpy()[assigned])
+
+
+# Function to sum up each cluster: its keywords, total volume, and mean CPC and
+# difficulty (KD). A cluster is labelled with its shortest keyword, usually the
+# term the others add to. Clusters are ordered by total volume (or size), members by rank.
+def cluster_table(clustered):
+    metrics = {
+        "Volume": ("Volume", "sum"),
+        "CPC": ("CPC (GBP)", "mean"),
+        "KD": ("Keyword Difficulty", "mean"),
+    }
+    aggregations = {
+        "Label": ("Keyword", lambda keywords: min(keywords, key=len)),
+        "Keywords": ("Keyword", list),
+        "Size": ("Keyword", "size"),
+    }
+    aggregations.update({name: spec for name, spec in metrics.items() if spec[0] in clustered})
+    table = clustered.groupby("Cluster", sort=False).agg(**aggregations).reset_index(drop=True)
+    sort_columns = ["Volume", "Size"] if "Volume" in table else ["Size"]
+    return table.sort_values(sort_columns, ascending=False, kind="stable").reset_index(drop=True)
+
+
+# Function to write the clusters as the compact text the topic cluster prompt
+# reads: one line per cluster with its aggregates and members, and the keywords
+# that matched nothing else on a final line
+def cluster_summary(frame, threshold=SIMILARITY):
+    if frame.empty:
+        return ""
+    table = cluster_table(cluster_keywords(frame, threshold))
+    groups = table[table["Size"] > 1]
+    singles = table[table["Size"] == 1]
+
+    lines = [f"{len(frame)} keywords in {len(table)} candidate clusters of similar keywords"
+             + (" (volume = monthly searches, CPC in GBP, KD = keyword difficulty 0-100):"
+                if "Volume" in table else ":")]
+    for number, cluster in enumerate(groups.itertuples(index=False), start=1):
+        details = [f"{cluster.Size} keywords"]
+        if "Volume" in table:
+            details.append(f"volume {cluster.Volume:,.0f}")
+        if "CPC" in table:
+            details.append(f"CPC {cluster.CPC:.2f}")
+        if "KD" in table:
+            details.append(f"KD {cluster.KD:.0f}")
+        lines.append(f"{number}. {cluster.Label} ({', '.join(details)}): {_members(cluster.Keywords)}")
+    if len(singles):
+        lines.append(f"Unclustered: {_members([keywords[0] for keywords in singles['Keywords']], limit=None)}")
+    return "\n".join(lines)
+
+
+def _members(keywords, limit=MAX_MEMBERS):
+    if limit is None or len(keywords) <= limit:
+        return "; ".join(keywords)
+    return "; ".join(keywords[:limit]) + f"; and {len(keywords) - limit} more"
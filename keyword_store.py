@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from artifacts import ArtifactIndex
+from atomic_files import atomic_path, atomic_write
+from keyword_clusters import cluster_summary
+from keywords import CHUNK_ROWS, COLUMNS, NUMERIC_COLUMNS, PER_SOURCE, TOP_KEYWORDS, iter_csv_chunks, rank_keywords
+from metrics import timed
+
+STORE_DIR = os.path.join("processed", ".keywords")
+
+# Bump when the ranking rules change, so cached top keyword views are recomputed
+RANKING_VERSION = "1"
+
+_lock = threading.Lock()
+
+
+# Function to hash an uploaded file (a path or a binary file object) in blocks
+def upload_hash(source):
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    else:
+        source.seek(0)
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+        source.seek(0)
+    return digest.hexdigest()
+
+
+# Function to convert a CSV chunk to an Arrow table: keywords as strings and the
+# metrics as float64, with unparseable values stored as nulls
+def _to_table(chunk):
+    frame = pd.DataFrame(index=chunk.index)
+    for column in COLUMNS:
+        if column not in chunk:
+            continue
+        if column in NUMERIC_COLUMNS:
+            frame[column] = chunk[column].astype("float64")
+        else:
+            frame[column] = chunk[column].astype("string")
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+# Keyword exports kept as Parquet, one file per distinct upload. Files are named
+# by the hash of the uploaded bytes and shared by every company that uploads the
+# same export, so it is converted and stored once. Each company has a manifest of
+# its member files in upload order and a cached top keyword view that is only
+# recomputed when the members (or the ranking rules) change.
+class KeywordStore:
+    def __init__(self, company_name, directory=STORE_DIR):
+        self.company_name = company_name
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.manifest_path = os.path.join(directory, f"{company_name}.json")
+        self.view_path = os.path.join(directory, f"{company_name}_top.parquet")
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    def _blob_path(self, file_hash):
+        return os.path.join(self.blob_dir, f"{file_hash}.parquet")
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"members": [], "view_key": None}
+
+    def _write_manifest(self, manifest):
+        atomic_write(self.manifest_path, json.dumps(manifest, indent=2))
+
+    @property
+    def members(self):
+        return self._read_manifest()["members"]
+
+    # Function to add a keyword export to the company's keywords. An export the
+    # company already has is ignored, and one any company uploaded before is not
+    # converted again. Returns True when the company's keywords changed.
+    def add_csv(self, source, name):
+        file_hash = upload_hash(source)
+        blob_path = self._blob_path(file_hash)
+        if not os.path.exists(blob_path):
+            with timed("csv_load", name) as sample:
+                self._convert(source, blob_path)
+                sample["units"] = pq.ParquetFile(blob_path).metadata.num_rows
+
+        with _lock:
+            manifest = self._read_manifest()
+            if any(member["hash"] == file_hash for member in manifest["members"]):
+                return False
+            rows = pq.ParquetFile(blob_path).metadata.num_rows
+            manifest["members"].append({"hash": file_hash, "name": name, "rows": rows})
+            self._write_manifest(manifest)
+        return True
+
+    # Function to forget the company's keyword exports; shared files stay for other
+    # companies. The cached view is kept: it is reused if the same exports are added back.
+    def clear(self):
+        with _lock:
+            manifest = self._read_manifest()
+            manifest["members"] = []
+            self._write_manifest(manifest)
+
+    # Function to stream a CSV into a Parquet file chunk by chunk, writing to a
+    # temporary file first so readers never see a partial file
+    def _convert(self, source, blob_path):
+        with atomic_path(blob_path) as tmp_path:
+            writer = None
+            try:
+                for chunk in iter_csv_chunks(source):
+                    table = _to_table(chunk)
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, table.schema)
+                    writer.write_table(table)
+                if writer is None:
+                    pq.write_table(_to_table(pd.DataFrame(columns=COLUMNS)), tmp_path)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+    # Function to read a member file in chunks through a memory map, loading only
+    # the columns the ranking uses
+    def iter_chunks(self, member, chunk_rows=CHUNK_ROWS):
+        parquet_file = pq.ParquetFile(self._blob_path(member["hash"]), memory_map=True)
+        columns = [column for column in COLUMNS if column in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+
+    def _view_key(self, members):
+        return hashlib.sha256(json.dumps({
+            "members": [member["hash"] for member in members],
+            "top_n": TOP_KEYWORDS,
+            "per_source": PER_SOURCE,
+            "version": RANKING_VERSION,
+        }).encode("utf-8")).hexdigest()
+
+    # Function to return the company's top keywords with their metrics, score and
+    # source, ranked over every member file. The result is cached and reused
+    # until the members change; recomputing also refreshes the CSV export in processed/.
+    def top_keywords(self):
+        manifest = self._read_manifest()
+        view_key = self._view_key(manifest["members"])
+        if manifest.get("view_key") == view_key and os.path.exists(self.view_path):
+            return pd.read_parquet(self.view_path)
+
+        # Sources are named by upload position, as the tab3 upload files used to be
+        sources = {
+            f"{self.company_name}_csv_file_{i + 1}": self.iter_chunks(member)
+            for i, member in enumerate(manifest["members"])
+        }
+        with timed("csv_rank", self.company_name) as sample:
+            top = rank_keywords(sources)
+            sample["units"] = sum(member["rows"] for member in manifest["members"])
+
+        with atomic_path(self.view_path) as tmp_path:
+            top.to_parquet(tmp_path, index=False)
+        export_path = os.path.join("processed", f"{self.company_name}_top_150_keywords.csv")
+        top["Keyword"].to_csv(export_path, index=False)
+        ArtifactIndex().record(self.company_name, export_path, "keywords")
+
+        with _lock:
+            current = self._read_manifest()
+            # Only mark the view current if no upload arrived while ranking
+            if self._view_key(current["members"]) == view_key:
+                current["view_key"] = view_key
+                self._write_manifest(current)
+        return top
+
+    # Function to return the top keywords as the CSV text the prompts read
+    def top_keywords_text(self):
+        return self.top_keywords()["Keyword"].to_csv(index=False)
+
+    # Function to return the top keywords grouped into clusters with their
+    # volume, CPC and difficulty, as the text the topic cluster prompt reads
+    def keyword_clusters_text(self):
+        top = self.top_keywords()
+        with timed("keyword_cluster", self.company_name) as sample:
+            sample["units"] = len(top)
+            return cluster_summary(top)
@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Columns read from the SEMrush keyword exports; everything else is skipped
+COLUMNS = ["Keyword", "Volume", "Keyword Difficulty", "CPC (GBP)"]
+
+NUMERIC_COLUMNS = ["Volume", "Keyword Difficulty", "CPC (GBP)"]
+
+# Metrics are parsed as floats while reading; blanks and the placeholders
+# exports use for a missing metric are read as NaN
+DTYPES = {"Keyword": "string", **{column: "float64" for column in NUMERIC_COLUMNS}}
+NA_VALUES = ["", "-", "--", "n/a", "N/A", "NA", "na", "null", "NULL", "None", "nan", "NaN"]
+
+# Used from the first chunk with a value that is not a number: metrics are read
+# as text and converted with pd.to_numeric, so stray values become NaN instead of failing the read
+TEXT_DTYPES = {column: "string" for column in COLUMNS}
+
+# Rows read from a CSV at a time; memory stays flat however large the export is
+CHUNK_ROWS = 100_000
+
+TOP_KEYWORDS = 150
+PER_SOURCE = 15
+
+# CPC floor used in the score so a zero CPC ranks high but finite
+MIN_CPC = 0.01
+
+
+# Function to read a keyword CSV (a path or file object) in chunks of CHUNK_ROWS,
+# keeping only COLUMNS, with the metrics as float64. If a chunk holds a metric
+# that does not parse, the rest of the file is read again from that chunk as
+# text and converted value by value.
+def iter_csv_chunks(file_path, chunk_rows=CHUNK_ROWS):
+    rows_read = 0
+    try:
+        with _read_csv(file_path, chunk_rows, DTYPES) as reader:
+            for chunk in reader:
+                rows_read += len(chunk)
+                yield chunk
+        return
+    except ValueError:
+        pass
+
+    if not isinstance(file_path, (str, os.PathLike)):
+        file_path.seek(0)
+    # Row 0 is the header; the rows already yielded are skipped
+    with _read_csv(file_path, chunk_rows, TEXT_DTYPES, skiprows=range(1, rows_read + 1)) as reader:
+        for chunk in reader:
+            for column in NUMERIC_COLUMNS:
+                if column in chunk:
+                    chunk[column] = pd.to_numeric(chunk[column], errors="coerce").astype("float64")
+            yield chunk
+
+
+def _read_csv(file_path, chunk_rows, dtypes, skiprows=None):
+    return pd.read_csv(
+        file_path,
+        usecols=lambda column: column in COLUMNS,
+        dtype=dtypes,
+        na_values={"Keyword": [""], **{column: NA_VALUES for column in NUMERIC_COLUMNS}},
+        keep_default_na=False,
+        skiprows=skiprows,
+        chunksize=chunk_rows,
+    )
+
+
+# Function to clean, filter and score one chunk in a single vectorized pass.
+# Missing volumes and CPCs count as 0 and missing difficulties as 100.
+# Score = log(Volume) / CPC, with Volume floored at 1 and CPC at MIN_CPC, so a
+# zero volume scores 0 and a zero CPC ranks high instead of giving inf or NaN.
+def score_chunk(chunk):
+    volume = _numeric(chunk, "Volume", 0)
+    difficulty = _numeric(chunk, "Keyword Difficulty", 100)
+    cpc = _numeric(chunk, "CPC (GBP)", 0)
+
+    keep = (volume >= 20) | (cpc >= 0.35) | ((difficulty <= 50) & (difficulty >= 10))
+    score = np.log(np.maximum(volume[keep], 1.0)) / np.maximum(cpc[keep], MIN_CPC)
+
+    return pd.DataFrame({
+        "Keyword": chunk["Keyword"].to_numpy()[keep],
+        "Volume": volume[keep],
+        "Keyword Difficulty": difficulty[keep],
+        "CPC (GBP)": cpc[keep],
+        "Score": score,
+    })
+
+
+def _numeric(chunk, column, missing):
+    if column not in chunk:
+        return np.full(len(chunk), float(missing))
+    values = chunk[column]
+    if values.dtype != np.float64:
+        values = pd.to_numeric(values, errors="coerce")
+    return values.fillna(missing).to_numpy(dtype=np.float64)
+
+
+# Function to keep the `k` best rows of `top` and `scored` together
+def _merge_top(top, scored, k):
+    if top is None:
+        return scored.nlargest(k, "Score")
+    return pd.concat([top, scored.nlargest(k, "Score")], ignore_index=True).nlargest(k, "Score")
+
+
+# Function to rank keywords from several sources, each an iterable of raw chunks.
+# Only bounded top-k frames are kept: the best `per_source` of each source and the
+# best 2 * `top_n` overall. Sources are taken in name order; the best `per_source`
+# of each are picked until `top_n` slots are used, the remaining slots are filled
+# with the best of the other rows, and the result is the best `top_n` by score.
+def rank_keywords(sources, top_n=TOP_KEYWORDS, per_source=PER_SOURCE):
+    source_tops = {}
+    global_top = None
+    row_offset = 0
+    for source in sorted(sources):
+        source_top = None
+        for chunk in sources[source]:
+            scored = score_chunk(chunk)
+            # Row ids tell picked rows apart when filling the remaining slots
+            scored["Row"] = np.arange(row_offset, row_offset + len(scored))
+            scored["Source"] = source
+            row_offset += len(scored)
+            source_top = _merge_top(source_top, scored, per_source)
+            global_top = _merge_top(global_top, scored, 2 * top_n)
+        if source_top is not None:
+            source_tops[source] = source_top
+
+    if global_top is None:
+        return score_chunk(pd.DataFrame(columns=COLUMNS)).assign(Source=pd.Series(dtype="string"))
+
+    picked = []
+    remaining_slots = top_n
+    for source in sorted(source_tops):
+        picked.append(source_tops[source])
+        remaining_slots -= len(source_tops[source])
+        if remaining_slots <= 0:
+            break
+
+    selected = pd.concat(picked, ignore_index=True) if picked else global_top.iloc[:0]
+    if remaining_slots > 0:
+        rest = global_top[~global_top["Row"].isin(selected["Row"])]
+        selected = pd.concat([selected, rest.nlargest(remaining_slots, "Score")], ignore_index=True)
+
+    return selected.nlargest(top_n, "Score").drop(columns="Row").reset_index(drop=True)
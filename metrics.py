@@ -0,0 +1,438 @@
+"""Per-step timings, token usage and estimated cost of pipeline runs.
+
+Usage:
+    python metrics.py export [--format json|prometheus] [--company NAME] [--runs 50]
+
+Every pipeline run (a job, or one tab of a batch run) collects one sample per
+step: wall time, time queued for a worker, time waiting on the rate limits
+and retry backoff, requests, retries, prompt, completion and cached tokens and
+estimated cost. PDF parsing and keyword CSV loading and ranking are timed as
+operation samples. Samples are kept in memory while the run goes and written
+to SQLite in one transaction when it ends, so the hot path never touches the
+disk. The app's metrics tab and the export command read them back.
+"""
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from sqlite_db import connect
+
+METRICS_DB = os.path.join("processed", ".metrics", "metrics.sqlite")
+
+# Runs older than this are dropped when a new run is saved
+KEEP_SECONDS = 30 * 24 * 3600
+
+# USD per million (input, cached input, output) tokens; models match by longest prefix
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4-turbo": (10.00, 10.00, 30.00),
+    "gpt-4": (30.00, 30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 0.50, 1.50),
+}
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+COUNTERS = ("requests", "retries", "cache_hits", "prompt_tokens", "completion_tokens", "cached_tokens")
+
+# (run, sample) the current thread's work is attributed to; sample is None outside a step
+_current = contextvars.ContextVar("metrics_current", default=(None, None))
+
+
+# Function to estimate the cost of a response in USD from its token counts
+def estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    matches = [name for name in PRICES if (model or "").startswith(name)]
+    if not matches:
+        return 0.0
+    prompt_price, cached_price, completion_price = PRICES[max(matches, key=len)]
+    return ((prompt_tokens - cached_tokens) * prompt_price + cached_tokens * cached_price
+            + completion_tokens * completion_price) / 1_000_000
+
+
+def _step_sample(run_id, step, queued):
+    sample = {"run_id": run_id, "kind": "step", "name": step.name, "status": "running", "started": time.time(),
+              "seconds": 0.0, "queue_seconds": queued, "wait_seconds": 0.0, "units": 0, "cost": 0.0, "model": None,
+              "profile": step.profile}
+    sample.update(dict.fromkeys(COUNTERS, 0))
+    return sample
+
+
+# Samples of one pipeline run, kept in memory until save()
+class RunMetrics:
+    def __init__(self, company_name, tab, run_id=None, store=None):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.company_name = company_name
+        self.tab = tab
+        self.store = store
+        self.started = time.time()
+        self.samples = []
+        self.lock = threading.Lock()
+
+    # Context in which operations (PDF parsing, keyword ranking) count towards this run
+    @contextmanager
+    def active(self):
+        token = _current.set((self, None))
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    # Function to wrap a step's func so calling it records a sample: the time
+    # between this call (when the step is handed to the executor) and the start
+    # is its queue time, and completions made while it runs are added to it
+    def step(self, step):
+        func = step.func
+        submitted = time.perf_counter()
+
+        def run(values):
+            started = time.perf_counter()
+            sample = _step_sample(self.run_id, step, started - submitted)
+            with self.lock:
+                self.samples.append(sample)
+            token = _current.set((self, sample))
+            try:
+                value = func(values)
+            except Exception:
+                sample["status"] = "failed"
+                raise
+            else:
+                sample["status"] = "done"
+            finally:
+                sample["seconds"] = time.perf_counter() - started
+                _current.reset(token)
+            return value
+        return run
+
+    # Function to record a step whose stored value was reused without running it
+    def reused(self, step):
+        sample = _step_sample(self.run_id, step, 0.0)
+        sample["status"] = "reused"
+        with self.lock:
+            self.samples.append(sample)
+
+    def add(self, sample):
+        sample["run_id"] = self.run_id
+        with self.lock:
+            self.samples.append(sample)
+
+    # Function to total the run's step samples, for job results and reports
+    def summary(self):
+        with self.lock:
+            steps = [sample for sample in self.samples if sample["kind"] == "step"]
+        summary = {name: sum(sample[name] for sample in steps) for name in COUNTERS}
+        summary["cost"] = round(sum(sample["cost"] for sample in steps), 6)
+        summary["steps"] = len(steps)
+        return summary
+
+    # Function to write the run and its samples in one transaction
+    def save(self, status="done"):
+        run = {"run_id": self.run_id, "company_name": self.company_name, "tab": self.tab, "status": status,
+               "started": self.started, "seconds": time.time() - self.started}
+        with self.lock:
+            samples = list(self.samples)
+        (self.store or MetricsStore()).save(run, samples)
+
+
+# Function to add a completed GPT call to the step running on this thread, if any
+def record_completion(completion, model):
+    run, sample = _current.get()
+    if sample is None:
+        return
+    usage = completion.usage or {}
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    with run.lock:
+        sample["model"] = model
+        sample["retries"] += completion.retries
+        sample["wait_seconds"] += completion.waited
+        if completion.cached:
+            sample["cache_hits"] += 1
+            return
+        sample["requests"] += 1
+        sample["prompt_tokens"] += usage.get("prompt_tokens", 0)
+        sample["completion_tokens"] += usage.get("completion_tokens", 0)
+        sample["cached_tokens"] += cached
+        sample["cost"] += estimate_cost(model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), cached)
+
+
+# Function to return `func` bound to the calling thread's run and step, for work
+# the step hands to other threads (e.g. condensing document chunks in parallel)
+def bound(func):
+    current = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(current)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+# Function to time an operation such as parsing a PDF or ranking keywords. The
+# yielded dict takes the units processed (pages, rows). Inside a run the sample
+# joins the run; otherwise it is written straight away.
+@contextmanager
+def timed(kind, name):
+    sample = {"kind": kind, "name": name, "status": "done", "started": time.time(), "units": 0}
+    started = time.perf_counter()
+    try:
+        yield sample
+    except Exception:
+        sample["status"] = "failed"
+        raise
+    finally:
+        sample["seconds"] = time.perf_counter() - started
+        run, _ = _current.get()
+        if run is not None:
+            run.add(sample)
+        else:
+            MetricsStore().save_samples([sample])
+
+
+# Runs and their samples, shared by the app, the workers and the batch runner
+class MetricsStore:
+    def __init__(self, path=METRICS_DB):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY,"
+                " company_name TEXT NOT NULL,"
+                " tab TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " started REAL NOT NULL,"
+                " seconds REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS runs_company ON runs (company_name, started)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS samples ("
+                " run_id TEXT,"
+                " kind TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " started REAL NOT NULL,"
+                " seconds REAL NOT NULL,"
+                " queue_seconds REAL NOT NULL DEFAULT 0,"
+                " wait_seconds REAL NOT NULL DEFAULT 0,"
+                " units INTEGER NOT NULL DEFAULT 0,"
+                " requests INTEGER NOT NULL DEFAULT 0,"
+                " retries INTEGER NOT NULL DEFAULT 0,"
+                " cache_hits INTEGER NOT NULL DEFAULT 0,"
+                " prompt_tokens INTEGER NOT NULL DEFAULT 0,"
+                " completion_tokens INTEGER NOT NULL DEFAULT 0,"
+                " cached_tokens INTEGER NOT NULL DEFAULT 0,"
+                " cost REAL NOT NULL DEFAULT 0,"
+                " model TEXT,"
+                " profile TEXT)"
+            )
+            # Databases created before step profiles existed
+            if "profile" not in {row["name"] for row in conn.execute("PRAGMA table_info(samples)")}:
+                conn.execute("ALTER TABLE samples ADD COLUMN profile TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS samples_run ON samples (run_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS samples_kind ON samples (kind, started)")
+
+    def _insert(self, conn, samples):
+        defaults = {"run_id": None, "queue_seconds": 0.0, "wait_seconds": 0.0, "cost": 0.0, "model": None,
+                    "profile": None}
+        defaults.update(dict.fromkeys(COUNTERS, 0))
+        columns = ("kind", "name", "status", "started", "seconds", "units", *defaults)
+        conn.executemany(
+            f"INSERT INTO samples ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [tuple(sample.get(column, defaults.get(column)) for column in columns) for sample in samples],
+        )
+
+    # Function to save a finished run with its samples, dropping runs past KEEP_SECONDS
+    def save(self, run, samples):
+        with connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO runs (run_id, company_name, tab, status, started, seconds)"
+                " VALUES (:run_id, :company_name, :tab, :status, :started, :seconds)",
+                run,
+            )
+            conn.execute("DELETE FROM samples WHERE run_id = ?", (run["run_id"],))
+            self._insert(conn, samples)
+            cutoff = time.time() - KEEP_SECONDS
+            conn.execute("DELETE FROM samples WHERE started < ?", (cutoff,))
+            conn.execute("DELETE FROM runs WHERE started < ?", (cutoff,))
+
+    # Function to save operation samples that ran outside any run
+    def save_samples(self, samples):
+        with connect(self.path) as conn:
+            self._insert(conn, samples)
+
+    # Function to list the most recent runs, newest first, with their step totals
+    def runs(self, company_name=None, limit=50):
+        query = (
+            "SELECT runs.*, COALESCE(SUM(s.requests), 0) AS requests, COALESCE(SUM(s.retries), 0) AS retries,"
+            " COALESCE(SUM(s.prompt_tokens), 0) AS prompt_tokens,"
+            " COALESCE(SUM(s.completion_tokens), 0) AS completion_tokens,"
+            " COALESCE(SUM(s.cached_tokens), 0) AS cached_tokens, COALESCE(SUM(s.cost), 0) AS cost"
+            " FROM runs LEFT JOIN samples s ON s.run_id = runs.run_id AND s.kind = 'step'"
+        )
+        params = []
+        if company_name is not None:
+            query += " WHERE runs.company_name = ?"
+            params.append(company_name)
+        query += " GROUP BY runs.run_id ORDER BY runs.started DESC LIMIT ?"
+        params.append(limit)
+        with connect(self.path) as conn:
+            return [dict(row) for row in conn.execute(query, params).fetchall()]
+
+    # Function to list the samples of the given runs, oldest first
+    def samples(self, run_ids):
+        if not run_ids:
+            return []
+        with connect(self.path) as conn:
+            return [dict(row) for row in conn.execute(
+                f"SELECT * FROM samples WHERE run_id IN ({', '.join('?' * len(run_ids))}) ORDER BY started",
+                list(run_ids),
+            ).fetchall()]
+
+    # Function to list operations timed outside any run (e.g. keyword uploads in the app), oldest first
+    def operations(self, since=0):
+        with connect(self.path) as conn:
+            return [dict(row) for row in conn.execute(
+                "SELECT * FROM samples WHERE run_id IS NULL AND started >= ? ORDER BY started", (since,)
+            ).fetchall()]
+
+    # Function to gather recent runs with their samples, and the operations timed
+    # outside runs since the oldest of them, as one JSON-ready dict
+    def export(self, company_name=None, limit=50):
+        runs = self.runs(company_name, limit)
+        by_run = {run["run_id"]: dict(run, samples=[]) for run in runs}
+        for sample in self.samples(list(by_run)):
+            by_run[sample["run_id"]]["samples"].append(sample)
+        since = runs[-1]["started"] if runs else 0
+        export = {"runs": list(by_run.values()), "operations": self.operations(since)}
+        export["profiles"] = profile_summary(export)
+        return export
+
+
+# Function to report each step profile's latency and output throughput over an
+# export's completed steps; steps answered wholly from the response cache are left out
+def profile_summary(export):
+    by_profile = {}
+    for run in export["runs"]:
+        for sample in run["samples"]:
+            if sample["kind"] == "step" and sample["status"] == "done" and sample["requests"]:
+                by_profile.setdefault(sample["profile"] or "default", []).append(sample)
+
+    summary = []
+    for profile, samples in sorted(by_profile.items()):
+        seconds = sorted(sample["seconds"] for sample in samples)
+        # Output throughput counts the time spent on requests, not waiting on the rate limits
+        working = sum(sample["seconds"] - sample["wait_seconds"] for sample in samples)
+        completion_tokens = sum(sample["completion_tokens"] for sample in samples)
+        summary.append({
+            "profile": profile,
+            "steps": len(samples),
+            "requests": sum(sample["requests"] for sample in samples),
+            "mean_seconds": round(sum(seconds) / len(seconds), 3),
+            "p95_seconds": round(seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))], 3),
+            "completion_tokens": completion_tokens,
+            "tokens_per_second": round(completion_tokens / working, 1) if working > 0 else None,
+            "cost": round(sum(sample["cost"] for sample in samples), 6),
+        })
+    return summary
+
+
+# Function to count values into the cumulative LATENCY_BUCKETS, as Prometheus histograms do
+def histogram(values, buckets=LATENCY_BUCKETS):
+    counts = [sum(1 for value in values if value <= bound) for bound in buckets]
+    return list(zip(buckets, counts))
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+# Function to render an export() dict in the Prometheus text exposition format:
+# step and operation latency histograms, and token, request, retry and cost totals
+def to_prometheus(export):
+    steps = {}
+    for run in export["runs"]:
+        for sample in run["samples"]:
+            if sample["kind"] == "step" and sample["status"] != "reused":
+                steps.setdefault((run["tab"], sample["name"], sample["profile"] or "default"), []).append(sample)
+    operations = {}
+    for sample in export["operations"] + [s for run in export["runs"] for s in run["samples"] if s["kind"] != "step"]:
+        operations.setdefault(sample["kind"], []).append(sample)
+
+    lines = [
+        "# HELP pipeline_step_seconds Wall time of pipeline steps.",
+        "# TYPE pipeline_step_seconds histogram",
+    ]
+    for (tab, step, profile), samples in sorted(steps.items()):
+        for bound, count in histogram([sample["seconds"] for sample in samples]):
+            lines.append(f"pipeline_step_seconds_bucket{{{_labels(tab=tab, step=step, profile=profile, le=bound)}}} {count}")
+        lines.append(f"pipeline_step_seconds_bucket{{{_labels(tab=tab, step=step, profile=profile, le='+Inf')}}} {len(samples)}")
+        lines.append(f"pipeline_step_seconds_sum{{{_labels(tab=tab, step=step, profile=profile)}}} "
+                     f"{sum(sample['seconds'] for sample in samples):.6f}")
+        lines.append(f"pipeline_step_seconds_count{{{_labels(tab=tab, step=step, profile=profile)}}} {len(samples)}")
+
+    totals = [
+        ("pipeline_step_queue_seconds_total", "Time steps waited for a free worker.", "queue_seconds"),
+        ("pipeline_step_wait_seconds_total", "Time steps waited on rate limits and retry backoff.", "wait_seconds"),
+        ("gpt_requests_total", "GPT requests sent.", "requests"),
+        ("gpt_retries_total", "GPT requests retried.", "retries"),
+        ("gpt_cache_hits_total", "GPT responses served from the response cache.", "cache_hits"),
+        ("gpt_prompt_tokens_total", "Prompt tokens sent.", "prompt_tokens"),
+        ("gpt_completion_tokens_total", "Completion tokens received.", "completion_tokens"),
+        ("gpt_cached_tokens_total", "Prompt tokens served from the provider's prompt cache.", "cached_tokens"),
+        ("gpt_cost_usd_total", "Estimated cost of GPT requests in USD.", "cost"),
+    ]
+    for metric, help_text, field in totals:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for (tab, step, profile), samples in sorted(steps.items()):
+            lines.append(f"{metric}{{{_labels(tab=tab, step=step, profile=profile)}}} {sum(sample[field] for sample in samples):g}")
+
+    lines.append("# HELP pipeline_operation_seconds Wall time of PDF parsing and keyword CSV loading and ranking.")
+    lines.append("# TYPE pipeline_operation_seconds histogram")
+    for kind, samples in sorted(operations.items()):
+        for bound, count in histogram([sample["seconds"] for sample in samples]):
+            lines.append(f"pipeline_operation_seconds_bucket{{{_labels(kind=kind, le=bound)}}} {count}")
+        lines.append(f"pipeline_operation_seconds_bucket{{{_labels(kind=kind, le='+Inf')}}} {len(samples)}")
+        lines.append(f"pipeline_operation_seconds_sum{{{_labels(kind=kind)}}} "
+                     f"{sum(sample['seconds'] for sample in samples):.6f}")
+        lines.append(f"pipeline_operation_seconds_count{{{_labels(kind=kind)}}} {len(samples)}")
+    lines.append("# HELP pipeline_operation_units_total Pages parsed and keyword rows loaded or ranked.")
+    lines.append("# TYPE pipeline_operation_units_total counter")
+    for kind, samples in sorted(operations.items()):
+        lines.append(f"pipeline_operation_units_total{{{_labels(kind=kind)}}} {sum(sample['units'] for sample in samples)}")
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export pipeline run metrics.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="print recent runs' metrics")
+    export_parser.add_argument("--format", choices=("json", "prometheus"), default="json")
+    export_parser.add_argument("--company", help="only this company's runs")
+    export_parser.add_argument("--runs", type=int, default=50, help="most recent runs to include")
+    export_parser.add_argument("--db", default=METRICS_DB)
+    args = parser.parse_args(argv)
+
+    export = MetricsStore(args.db).export(args.company, args.runs)
+    if args.format == "json":
+        json.dump(export, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        sys.stdout.write(to_prometheus(export))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import threading
+
+from atomic_files import atomic_write
+
+# Folder holding the extracted PDF text, one file per (content hash, extractor version)
+CACHE_DIR = os.path.join(".cache", "pdf_text")
+
+# Upper bound on the total size of the cache folder; least recently used entries go first
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+_lock = threading.Lock()
+
+
+# Function to hash a file's bytes so identical uploads share one cache entry
+def file_hash(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function to drop least recently used entries until a cache folder fits in max_bytes
+def _evict(cache_dir, max_bytes):
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if name.endswith(".tmp"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+# Function to return the text cached under `key` in `cache_dir`, computing and
+# storing it on a miss. Entries are files; the least recently used are evicted.
+def cached_text(cache_dir, key, compute, max_bytes=MAX_CACHE_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_path = os.path.join(cache_dir, f"{key}.txt")
+
+    try:
+        with open(entry_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        # Touch the entry so eviction sees it as recently used
+        os.utime(entry_path)
+        return text
+    except FileNotFoundError:
+        pass
+
+    text = compute()
+
+    # Written atomically so a concurrent reader never sees a partial entry
+    atomic_write(entry_path, text, encoding="utf-8")
+
+    with _lock:
+        _evict(cache_dir, max_bytes)
+    return text
+
+
+# Function to return the extracted text of a PDF, parsing it only on a cache miss.
+# `extract` is called with the file path; `version` must change whenever the
+# extractor's output would, so stale text is never served.
+def cached_pdf_text(file_path, extract, version, max_bytes=MAX_CACHE_BYTES):
+    key = f"{file_hash(file_path)}_{version}"
+    return cached_text(CACHE_DIR, key, lambda: extract(file_path), max_bytes)
@@ -0,0 +1,112 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+
+# Bump whenever the extracted text would change so cached text is re-extracted
+EXTRACTOR_VERSION = "pypdf2-1"
+
+# One extracted page: 1-based page number, its text and how long extraction took
+PageText = namedtuple("PageText", ["number", "text", "seconds"])
+
+# Pages handed to a worker at a time; documents this size or smaller are parsed inline
+CHUNK_PAGES = 16
+
+# Upper bound on worker processes, shared by every document parsed in this process
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+# The pool is created on first use and shared, so concurrent documents (for
+# example the pillar pages of one run) do not each start their own. Its workers
+# are started by a fork server (or spawned where there is none) rather than
+# forked from this process, whose job, step and transport threads could hold
+# locks a forked child would inherit.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Function to return the shared pool, creating it on first use
+def _shared_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=context)
+        return _pool
+
+
+# Function to drop a pool whose worker died, so the next document starts a new one
+def _reset_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Function to extract a range of pages, run inside a worker process
+def _extract_range(file_path, start, stop):
+    pages = []
+    with open(file_path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        for page_num in range(start, stop):
+            started = time.perf_counter()
+            text = reader.pages[page_num].extract_text()
+            pages.append(PageText(page_num + 1, text, time.perf_counter() - started))
+    return pages
+
+
+# Function to count the pages of a PDF without extracting any text
+def page_count(file_path):
+    with open(file_path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+# Function to yield a PDF's pages in order as soon as each one is extracted.
+# Page ranges are split across the shared process pool, at most `workers` of
+# them in flight for one document; small documents skip the pool.
+def iter_pages(file_path, workers=MAX_WORKERS, chunk_pages=CHUNK_PAGES):
+    total = page_count(file_path)
+    if total <= chunk_pages or workers <= 1:
+        for start in range(0, total, chunk_pages):
+            yield from _extract_range(file_path, start, min(start + chunk_pages, total))
+        return
+
+    ranges = [(start, min(start + chunk_pages, total)) for start in range(0, total, chunk_pages)]
+    pool = _shared_pool()
+    futures = []
+    try:
+        futures = [pool.submit(_extract_range, file_path, start, stop) for start, stop in ranges[:workers]]
+        # Futures are consumed in page order, so the caller sees the document front to back;
+        # each finished range lets the next one start
+        for position in range(len(ranges)):
+            pages = futures[position].result()
+            if position + workers < len(ranges):
+                futures.append(pool.submit(_extract_range, file_path, *ranges[position + workers]))
+            yield from pages
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+# Function to extract all pages, keeping page boundaries and per-page timings
+def extract_pages(file_path, workers=MAX_WORKERS, chunk_pages=CHUNK_PAGES):
+    return list(iter_pages(file_path, workers, chunk_pages))
+
+
+# Function to extract the full text of a PDF, joined in linear time
+def extract_text(file_path, workers=MAX_WORKERS, chunk_pages=CHUNK_PAGES):
+    return "".join(page.text for page in iter_pages(file_path, workers, chunk_pages))
+
+
+# Function to list the slowest pages of a previous extraction, slowest first
+def slowest_pages(pages, limit=5):
+    return sorted(pages, key=lambda page: page.seconds, reverse=True)[:limit]
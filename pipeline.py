@@ -0,0 +1,521 @@
+import hashlib
+import io
+import json
+import os
+import queue
+import re
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from artifact_store import default_store
+import metrics
+from context_builder import CONDENSABLE, ContextBuilder, document_reference, split_document
+from keyword_clusters import cluster_summary
+from keyword_store import KeywordStore
+from pdf_cache import cached_pdf_text, file_hash
+from pdf_extract import EXTRACTOR_VERSION, extract_pages
+from step_graph import Step, required_steps
+from step_profiles import StepProfiles
+
+# Company documents uploaded in tab1, keyed by the name steps use for them
+DOCUMENT_FILES = {
+    "product_list": "product_list.pdf",
+    "USP": "USP.pdf",
+    "key_stats": "key_stats.pdf",
+    "about_us": "about_us.pdf",
+    "colour_scheme": "colour_scheme.pdf",
+}
+
+# Editor passes send documents in chunks of about this many tokens (see
+# context_builder.split_document), at most EDITOR_WORKERS chunks at a time per document
+EDITOR_CHUNK_TOKENS = 1_200
+EDITOR_MIN_CHUNK_TOKENS = 300
+EDITOR_WORKERS = 4
+
+# Each tab's output files, offered for download as {company_name}_specific_outputs_{tab}.zip
+# (built in memory when asked for, see bundles.company_bundle)
+TAB_OUTPUTS = {
+    "tab2": ["buyer_persona.txt", "mission_values.txt", "seo_summarizer.txt", "seo_keywords.txt"],
+    "tab4": [
+        "topic_cluster_document.txt",
+        "keywords.txt",
+        "website_structure_document.txt",
+        "brand_voice.txt",
+        "home_page.txt",
+        "home_page_final.txt",
+        "about_us.txt",
+        "about_us_final.txt",
+    ],
+    "tab5": ["pillar_page.txt", "pillar_page_final.txt"],
+}
+
+# Instructions of prompts.json templates that are neither named after the
+# template nor the general "editor" ones (see Pipeline.template_step)
+TEMPLATE_INSTRUCTIONS = {
+    "prompt_services_page": "products_page",
+}
+
+
+# Function to tell whether a file in processed/ (without the company prefix) is
+# one of a tab's outputs; tab5 also writes one pair of files per pillar page
+def is_tab_output(tab, file_name):
+    if file_name in TAB_OUTPUTS[tab]:
+        return True
+    return tab == "tab5" and file_name.startswith("pillar_page_") and file_name.endswith(".txt")
+
+
+# Function to give each uploaded pillar page a name for its steps and output
+# files, taken from its file name: "Best Running Shoes.pdf" gives
+# "best_running_shoes". A page's edited version adds "_final" to its name, so
+# names ending in "final" get "_page" added ("Guide Final.pdf" gives
+# "guide_final_page"), keeping them apart from the edited version of another
+# page and from the single-page pillar_page_final.txt. Names that clash within
+# one upload get a number added.
+def pillar_page_names(file_names):
+    names = []
+    for file_name in file_names:
+        stem = os.path.splitext(os.path.basename(file_name))[0]
+        name = re.sub(r"[^a-z0-9]+", "_", stem.lower()).strip("_") or "page"
+        if name == "final" or name.endswith("_final"):
+            name = f"{name}_page"
+        unique, n = name, 2
+        while unique in names:
+            unique, n = f"{name}_{n}", n + 1
+        names.append(unique)
+    return names
+
+
+# Function to name the draft and edited output files of a named pillar page
+def pillar_page_files(page):
+    return f"pillar_page_{page}.txt", f"pillar_page_{page}_final.txt"
+
+
+# Function to list the placeholders of a prompts.json template, in order of first use
+def template_fields(template):
+    return list(dict.fromkeys(field for _, field, _, _ in string.Formatter().parse(template) if field))
+
+
+# Function to list the files (without the company prefix) a company's steps write to processed/
+def step_files(company_name, steps):
+    return [step_file(company_name, step) for step in steps if step.output]
+
+
+# Function to return the file (without the company prefix) a step writes to processed/, or None
+def step_file(company_name, step):
+    if not step.output:
+        return None
+    return os.path.basename(step.output)[len(f"{company_name}_"):]
+
+
+# Function to list every file name a company's runs write to processed/, without the company
+# prefix, with the tab zips older runs wrote there
+def artifact_file_names():
+    file_names = ["top_150_keywords.csv"]
+    for tab, outputs in TAB_OUTPUTS.items():
+        file_names.extend(outputs)
+        file_names.append(f"specific_outputs_{tab}.zip")
+    return file_names
+
+
+# Function to extract a PDF's text, timing the parse and counting its pages
+def _extract_text(file_path):
+    with metrics.timed("pdf_parse", os.path.basename(file_path)) as sample:
+        pages = extract_pages(file_path)
+        sample["units"] = len(pages)
+    return "".join(page.text for page in pages)
+
+
+# Function to read PDF content, parsing each distinct file only once
+def read_pdf(file_path):
+    return cached_pdf_text(file_path, _extract_text, EXTRACTOR_VERSION)
+
+
+def upload_path(company_name, file_name):
+    return os.path.join("uploads", f"{company_name}_{file_name}")
+
+
+# Function to return where a named pillar page's PDF is uploaded. Pages keep
+# their own files, so uploading one never replaces another.
+def pillar_page_upload_path(company_name, page):
+    return os.path.join("uploads", f"{company_name}_pillar_pages", f"{page}.pdf")
+
+
+def processed_path(company_name, file_name):
+    return os.path.join("processed", f"{company_name}_{file_name}")
+
+
+# Function to read the uploaded company documents that exist, keyed by document
+# name; with `names`, only those documents are read
+def load_documents(company_name, names=None):
+    documents = {}
+    for name, file_name in DOCUMENT_FILES.items():
+        if names is not None and name not in names:
+            continue
+        file_path = upload_path(company_name, file_name)
+        if os.path.exists(file_path):
+            documents[name] = read_pdf(file_path)
+    return documents
+
+
+# Function to read previously processed text files, keyed by value name. Files
+# written by this process's runs are served from the artifact store's memory.
+def load_processed(company_name, file_names):
+    values = {}
+    store = default_store()
+    for name, file_name in file_names.items():
+        path = processed_path(company_name, file_name)
+        values[name] = store.read(path)
+        if values[name] is None:
+            raise FileNotFoundError(f"No such file: '{path}'")
+    return values
+
+
+# Function to gather the given values tab4's steps start from; with `names`
+# (see step_graph.given_inputs), only the values the steps read
+def tab4_values(company_name, names=None):
+    names = set(DOCUMENT_FILES) | {"buyer_persona", "top_keywords"} if names is None else set(names)
+    values = {name: "" for name in DOCUMENT_FILES if name in names}
+    values.update(load_documents(company_name, names))
+    if "buyer_persona" in names:
+        values.update(load_processed(company_name, {"buyer_persona": "buyer_persona.txt"}))
+    if "top_keywords" not in names:
+        return values
+    store = KeywordStore(company_name)
+    if store.members:
+        values["top_keywords"] = store.keyword_clusters_text()
+    else:
+        # Companies whose keywords were processed before the keyword store existed;
+        # their CSV only has the keywords, so the clusters come without metrics
+        csv_text = load_processed(company_name, {"top_keywords": "top_150_keywords.csv"})["top_keywords"]
+        values["top_keywords"] = cluster_summary(pd.read_csv(io.StringIO(csv_text), dtype="string"))
+    return values
+
+
+# Function to gather the given values tab5's steps start from: the brand voice
+# and keywords, read once and shared by every page, and the text of the single
+# pillar page at `pillar_page_path`. Pages in `pillar_pages` ({name: path}) are
+# parsed by their own steps (see Pipeline.tab5_steps); only the hash of each
+# PDF is given here, so a replaced file is parsed again.
+def tab5_values(company_name, pillar_page_path=None, pillar_pages=None):
+    values = load_processed(company_name, {
+        "brand_voice": "brand_voice.txt",
+        "keywords": "keywords.txt",
+    })
+    if pillar_page_path:
+        values["pillar_page_content"] = read_pdf(pillar_page_path)
+    for page, path in (pillar_pages or {}).items():
+        values[f"pillar_pdf_{page}"] = file_hash(path)
+    return values
+
+
+# Builds the steps of a run for one company. `run_task(instructions, prompt, refresh)`
+# performs the GPT call, so the same steps serve the UI and headless runs.
+# Steps named in `refresh` bypass cached responses and are regenerated.
+# With `on_text(step_name, text)` responses are streamed: each delta is passed to
+# it and appended to the step's output file as it arrives, off the transport's
+# loop thread. Prompts are fitted to each step's token budget by `context`
+# (a context_builder.ContextBuilder).
+# Each step's requests use the model, max_tokens, temperature and timeout of
+# its profile in `profiles` (a step_profiles.StepProfiles).
+#
+# With `shared_context` (the default) steps that read company documents do not
+# paste them into their prompt. The documents go into one company context block,
+# sent as the first message of every such step, so all of them share a
+# byte-identical prefix the provider can cache; the step's instructions and prompt
+# follow it, with the document placeholders pointing at the block.
+class Pipeline:
+    def __init__(self, company_name, prompts, instructions, run_task, refresh=(), on_text=None, context=None,
+                 shared_context=True, profiles=None):
+        self.company_name = company_name
+        self.prompts = prompts
+        self.instructions = instructions
+        self.run_task = run_task
+        self.refresh = set(refresh)
+        self.on_text = on_text
+        self.profiles = profiles or StepProfiles()
+        self.context = context or ContextBuilder(
+            company_name, prompts, instructions, run_task,
+            condense_options=self.profiles.request("condense", "prompt_condense_document"),
+        )
+        self.shared_context = shared_context
+
+    # Function to return a step's request options and the part of them that
+    # changes its output, which goes into the step's key
+    def _options(self, name, prompt_key):
+        options = self.profiles.request(name, prompt_key)
+        return options, {field: value for field, value in options.items() if field != "timeout"}
+
+    def _step(self, name, func, inputs, output_path, key, prompt_key):
+        profile = self.profiles.profile(name, prompt_key)
+        return Step(name, func, inputs=inputs, output=output_path, key=key, force=name in self.refresh,
+                    priority=profile["priority"], profile=self.profiles.name(name, prompt_key))
+
+    # A step that formats a prompts.json template and sends it with one of the
+    # instructions. The step reads one value per placeholder of the template: the
+    # value of the same name, or the one `sources` maps the placeholder to.
+    # company_name and `constants` fill their placeholders directly.
+    def gpt_step(self, name, prompt_key, instruction_key, sources=None, output=None, constants=None):
+        fixed = {"company_name", *(constants or {})}
+        fields = {
+            placeholder: (sources or {}).get(placeholder, placeholder)
+            for placeholder in template_fields(self.prompts[prompt_key]) if placeholder not in fixed
+        }
+        shared = self.shared_context and any(source in CONDENSABLE for source in fields.values())
+        options, output_options = self._options(name, prompt_key)
+
+        def func(values):
+            prompt_fields = {"company_name": self.company_name}
+            prompt_fields.update(constants or {})
+            prompt_fields.update({placeholder: values[source] for placeholder, source in fields.items()})
+            run_kwargs = {"refresh": name in self.refresh, **options}
+            if shared:
+                prompt_fields.update({
+                    placeholder: document_reference(source)
+                    for placeholder, source in fields.items() if source in CONDENSABLE
+                })
+                run_kwargs["context"] = self.context.step_block(
+                    name, self.prompts[prompt_key], self.instructions[instruction_key], prompt_fields,
+                    {source: values[source] for source in CONDENSABLE},
+                )
+            # Oversized documents are swapped for condensed versions that fit what the
+            # company block leaves of the step's budget
+            prompt_fields = self.context.fit(name, self.prompts[prompt_key], self.instructions[instruction_key], prompt_fields,
+                                             context=run_kwargs.get("context"))
+            prompt = self.prompts[prompt_key].format(**prompt_fields)
+            if self.on_text is None:
+                return self.run_task(self.instructions[instruction_key], prompt, **run_kwargs)
+            return self._stream(name, output_path, self.instructions[instruction_key], prompt, **run_kwargs)
+
+        # Anything besides the inputs that changes the prompt goes into the step's key
+        key = hashlib.sha256(json.dumps(
+            [self.prompts[prompt_key], self.instructions[instruction_key], constants or {}, fields, shared,
+             output_options],
+            sort_keys=True,
+        ).encode("utf-8")).hexdigest()
+        inputs = dict.fromkeys(fields.values())
+        if shared:
+            # The context block carries every document, so the step depends on all of them
+            inputs.update(dict.fromkeys(CONDENSABLE))
+        output_path = processed_path(self.company_name, output) if output else None
+        return self._step(name, func, inputs, output_path, key, prompt_key)
+
+    # A step for a prompts.json template that no tab wires in, so a new template
+    # can be requested as an output without code changes. "prompt_services_page"
+    # gives the step "services_page_document", written to services_page_document.txt.
+    # It is sent with the instructions named in TEMPLATE_INSTRUCTIONS, else those
+    # named after the template, else the general "editor" ones.
+    def template_step(self, prompt_key, sources=None):
+        name = prompt_key[len("prompt_"):] if prompt_key.startswith("prompt_") else prompt_key
+        instruction_key = TEMPLATE_INSTRUCTIONS.get(prompt_key) or (name if name in self.instructions else "editor")
+        return self.gpt_step(f"{name}_document", prompt_key, instruction_key, sources, output=f"{name}_document.txt")
+
+    # Function to keep the steps a tab's `outputs` need: the steps producing them
+    # and, transitively, the steps those read, so nothing else is sent or parsed.
+    # Outputs are file names written to processed/ (without the company prefix),
+    # step names, or prompts.json keys of templates no step uses (see
+    # template_step), which read the tab's values through `sources`. By default
+    # the outputs are the tab's files (see is_tab_output).
+    def _requested(self, tab, steps, outputs, sources):
+        files = dict(zip(step_files(self.company_name, steps), [step for step in steps if step.output]))
+        if outputs is None:
+            outputs = [file_name for file_name in files if is_tab_output(tab, file_name)]
+        names = {step.name for step in steps}
+
+        steps = list(steps)
+        targets = []
+        for output in outputs:
+            if output in files:
+                targets.append(files[output].name)
+            elif output in names:
+                targets.append(output)
+            elif output in self.prompts:
+                step = self.template_step(output, sources)
+                if step.name not in names:
+                    steps.append(step)
+                    names.add(step.name)
+                targets.append(step.name)
+            else:
+                raise ValueError(f"Unknown {tab} output: '{output}'")
+        return required_steps(steps, targets)
+
+    # Function to stream a step's response to on_text and, when it has one, to a
+    # "<output>.partial" file next to its output. The output file keeps its
+    # previous version until the complete response replaces it.
+    # Deltas arrive on the transport's loop thread, which must not block, so they
+    # are queued there and written and passed to on_text by a thread of the step's
+    # own; the step returns once that thread has caught up.
+    def _stream(self, name, output_path, instructions, prompt, **run_kwargs):
+        partial = open(f"{output_path}.partial", "w") if output_path else None
+        deltas = queue.Queue()
+        errors = []
+
+        def write():
+            while True:
+                text = deltas.get()
+                if text is None:
+                    return
+                if errors:
+                    continue
+                try:
+                    if partial is not None:
+                        partial.write(text)
+                        partial.flush()
+                    self.on_text(name, text)
+                except Exception as e:
+                    errors.append(e)
+
+        writer = threading.Thread(target=write, name=f"stream-{name}", daemon=True)
+        writer.start()
+        try:
+            value = self.run_task(instructions, prompt, on_text=deltas.put, **run_kwargs)
+        finally:
+            deltas.put(None)
+            writer.join()
+            if partial is not None:
+                partial.close()
+        if errors:
+            raise errors[0]
+        if partial is not None:
+            os.remove(partial.name)
+        return value
+
+    # A British English editing pass over the value of `source`. The document is
+    # split at section and paragraph boundaries and the chunks are edited
+    # concurrently, then joined in order, so a long document takes about as long
+    # as its largest chunk and no response is cut short. Chunks keep their
+    # boundaries when other parts of the document change, so after a small edit
+    # the unchanged chunks are byte-identical requests the response cache answers.
+    def editor_step(self, name, source, file_name, output=None):
+        template = self.prompts["prompt_english_editor"]
+        instructions = self.instructions["english_editor"]
+        label = f"{self.company_name}_{file_name}"
+        options, output_options = self._options(name, "prompt_english_editor")
+
+        def func(values):
+            run_kwargs = {"refresh": name in self.refresh, **options}
+
+            def edit(chunk):
+                return self.run_task(instructions, template.format(file_name=label, file_content=chunk), **run_kwargs)
+
+            chunks = split_document(values[source], EDITOR_CHUNK_TOKENS, EDITOR_MIN_CHUNK_TOKENS)
+            return self._edit_chunks(name, output_path, chunks, edit)
+
+        key = hashlib.sha256(json.dumps(
+            [template, instructions, label, EDITOR_CHUNK_TOKENS, EDITOR_MIN_CHUNK_TOKENS, output_options],
+            sort_keys=True,
+        ).encode("utf-8")).hexdigest()
+        output_path = processed_path(self.company_name, output) if output else None
+        return self._step(name, func, [source], output_path, key, "prompt_english_editor")
+
+    # A step that returns the text of the PDF at `path`. It reads `source`, the
+    # hash of the file, so its fingerprint changes when the file does. Parsing
+    # starts after any GPT step that is ready at the same time.
+    def pdf_step(self, name, source, path):
+        key = hashlib.sha256(json.dumps([path, EXTRACTOR_VERSION]).encode("utf-8")).hexdigest()
+        return Step(name, lambda values: read_pdf(path), inputs=[source], key=key, force=name in self.refresh,
+                    priority=-1)
+
+    # Function to edit chunks concurrently and join the results in order. With
+    # on_text, each edited chunk is passed on (and appended to "<output>.partial")
+    # as soon as every chunk before it is done, so the text still arrives in order.
+    def _edit_chunks(self, name, output_path, chunks, edit):
+        streaming = self.on_text is not None
+        partial = open(f"{output_path}.partial", "w") if streaming and output_path else None
+        edited = []
+        try:
+            with ThreadPoolExecutor(max_workers=EDITOR_WORKERS) as executor:
+                # Bound to this step, so the chunk requests count towards its metrics
+                futures = [executor.submit(metrics.bound(edit), chunk) for chunk in chunks]
+                try:
+                    for future in futures:
+                        text = future.result().strip()
+                        piece = f"\n\n{text}" if edited else text
+                        edited.append(text)
+                        if partial is not None:
+                            partial.write(piece)
+                            partial.flush()
+                        if streaming:
+                            self.on_text(name, piece)
+                except Exception:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            if partial is not None:
+                partial.close()
+        if partial is not None:
+            os.remove(partial.name)
+        return "\n\n".join(edited)
+
+    # Tab2: buyer persona, mission values, SEO summary and SEO keywords.
+    # Each tab's steps are kept to those its `outputs` need (see _requested).
+    def tab2_steps(self, outputs=None):
+        sources = {"english_editor_seo_output": "seo_summarizer_final", "colour_scheme_text": "colour_scheme"}
+        steps = [
+            self.gpt_step("buyer_persona", "prompt_buyer_persona", "buyer_persona", sources),
+            self.editor_step("buyer_persona_final", "buyer_persona", "buyer_persona.txt", output="buyer_persona.txt"),
+            self.gpt_step("mission_values", "prompt_mission_statement", "mission_statement", sources),
+            self.editor_step("mission_values_final", "mission_values", "mission_values.txt", output="mission_values.txt"),
+            self.gpt_step("seo_summarizer", "prompt_seo_summarizer", "seo_summarizer", sources),
+            self.editor_step("seo_summarizer_final", "seo_summarizer", "seo_summarizer.txt", output="seo_summarizer.txt"),
+            self.gpt_step("seo_keywords", "prompt_magic_words", "magic_words", sources, output="seo_keywords.txt"),
+        ]
+        return self._requested("tab2", steps, outputs, sources)
+
+    # Tab4: topic cluster, website structure, brand voice, home page and about us page.
+    # Expects buyer_persona and top_keywords (the keyword cluster summary) as given values.
+    # The home and about us page structures are only extracted when requested.
+    def tab4_steps(self, outputs=None):
+        sources = {"seo_keywords": "top_keywords", "brand_voice_text": "brand_voice_final",
+                   "colour_scheme_text": "colour_scheme"}
+        steps = [
+            self.gpt_step("topic_cluster_document", "prompt_topic_cluster", "topic_cluster", sources,
+                          output="topic_cluster_document.txt"),
+            self.gpt_step("keywords", "prompt_extract_keywords", "editor", sources, output="keywords.txt"),
+            self.gpt_step("website_structure_document", "prompt_website_structure", "website_structure", sources,
+                          output="website_structure_document.txt"),
+            self.gpt_step("brand_voice", "prompt_brand_voice", "brand_voice", sources),
+            self.editor_step("brand_voice_final", "brand_voice", "brand_voice.txt", output="brand_voice.txt"),
+            self.gpt_step("home_page_structure", "prompt_extract_home_page", "editor", sources),
+            self.gpt_step("home_page", "prompt_home_page", "home_page", sources, output="home_page.txt"),
+            self.editor_step("home_page_final", "home_page", "home_page.txt", output="home_page_final.txt"),
+            self.gpt_step("about_us_structure", "prompt_extract_about_us", "editor", sources),
+            self.gpt_step("about_us_document", "prompt_about_us", "about_us", sources, output="about_us.txt"),
+            self.editor_step("about_us_final", "about_us_document", "about_us.txt", output="about_us_final.txt"),
+        ]
+        return self._requested("tab4", steps, outputs, sources)
+
+    # Tab5: pillar page and its edited version.
+    # Expects pillar_page_content, brand_voice and keywords as given values.
+    # With `pages` (names from pillar_page_names, or {name: PDF path}; by default
+    # a page's PDF is at its pillar_page_upload_path) every page gets its own
+    # steps and files: its PDF is parsed by a "pillar_text_<page>" step reading
+    # the "pillar_pdf_<page>" hash, then drafted and edited. The
+    # pages share nothing but brand_voice and keywords, so they run as
+    # concurrently as the worker pool allows; a page's draft starts as soon as
+    # its own PDF is parsed, and is edited as soon as it is done.
+    def tab5_steps(self, pages=None, outputs=None):
+        sources = {"brand_voice_text": "brand_voice"}
+        if pages is None:
+            steps = [
+                self.gpt_step("pillar_page", "prompt_pillar_page", "pillar_page", sources, output="pillar_page.txt"),
+                self.editor_step("pillar_page_final", "pillar_page", "pillar_page.txt", output="pillar_page_final.txt"),
+            ]
+            return self._requested("tab5", steps, outputs, sources)
+
+        paths = pages if isinstance(pages, dict) else {
+            page: pillar_page_upload_path(self.company_name, page) for page in pages
+        }
+        steps = []
+        for page, path in paths.items():
+            # Outside the "pillar_page_<page>" names, which any page name could produce
+            steps.append(self.pdf_step(f"pillar_text_{page}", f"pillar_pdf_{page}", path))
+            page_sources = {**sources, "pillar_page_content": f"pillar_text_{page}"}
+            draft, final = pillar_page_files(page)
+            steps.append(self.gpt_step(f"pillar_page_{page}", "prompt_pillar_page", "pillar_page", page_sources,
+                                       output=draft))
+            steps.append(self.editor_step(f"pillar_page_{page}_final", f"pillar_page_{page}", draft, output=final))
+        return self._requested("tab5", steps, outputs, sources)
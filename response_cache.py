@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from sqlite_db import connect
+
+CACHE_PATH = os.path.join(".cache", "responses.sqlite")
+
+# Entries older than this are treated as misses and removed
+DEFAULT_TTL = 7 * 24 * 60 * 60
+
+# Upper bound on the stored response text; least recently used entries go first
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+# Function to build the cache key of a request: a hash of the model, the
+# instructions, the fully formatted prompt and every generation parameter
+def request_key(payload):
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+# On-disk memo of GPT responses, shared by every process using the same file
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " text TEXT NOT NULL,"
+                " usage TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    # Function to look up a response; returns (text, usage) or None on a miss
+    def get(self, key):
+        now = time.time()
+        with self._lock, connect(self.path) as conn:
+            row = conn.execute("SELECT text, usage, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[2] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0], json.loads(row[1])
+
+    # Function to store a response and evict old entries past the size cap
+    def put(self, key, text, usage=None):
+        now = time.time()
+        size = len(text.encode("utf-8"))
+        with self._lock, connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, text, usage, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, text, json.dumps(usage or {}), size, now, now),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    # Function to report hit/miss counts for this process and the size of the store
+    def stats(self):
+        with connect(self.path) as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
+
+    def clear(self):
+        with self._lock, connect(self.path) as conn:
+            conn.execute("DELETE FROM responses")
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import threading
+
+from artifact_store import default_store
+from atomic_files import atomic_write
+
+_lock = threading.Lock()
+
+
+# Function to hash a text value
+def content_hash(value):
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+# Records, per company, the input fingerprint of every step that completed and
+# keeps a copy of step values that have no output file of their own (drafts that
+# an editor pass replaces). A later run skips steps whose fingerprint still
+# matches, so it resumes after the last failure and only recomputes steps whose
+# inputs changed, including steps downstream of a file a user re-uploaded.
+# With an artifact_store.ArtifactStore, values are written and read through it
+# and output files are recorded in its artifact index under `company_name`.
+class RunState:
+    def __init__(self, directory, company_name=None, store=None):
+        self.directory = directory
+        self.company_name = company_name
+        self.store = store
+        self.path = os.path.join(directory, "state.json")
+        self.skipped = []
+        self.ran = []
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.path, "r") as f:
+                self.records = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.records = {}
+
+    def _value_path(self, step_name):
+        return os.path.join(self.directory, f"{step_name}.txt")
+
+    # Function to fingerprint a step: its name, its configuration key and the
+    # content of every input it reads
+    def fingerprint(self, step, step_values):
+        digest = hashlib.sha256()
+        digest.update(step.name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(step.key.encode("utf-8"))
+        for name in sorted(step_values):
+            digest.update(b"\0")
+            digest.update(name.encode("utf-8"))
+            digest.update(b"=")
+            digest.update(content_hash(step_values[name]).encode("utf-8"))
+        return digest.hexdigest()
+
+    # Function to return a step's stored value if its fingerprint still matches.
+    # When the step has an output file its current content wins, so user edits
+    # made after the run flow into the steps that read it.
+    def lookup(self, step, fingerprint):
+        record = self.records.get(step.name)
+        if record is None or record["fingerprint"] != fingerprint:
+            return None
+        path = step.output or self._value_path(step.name)
+        if self.store is not None:
+            value = self.store.read(path)
+        else:
+            try:
+                with open(path, "r") as f:
+                    value = f.read()
+            except FileNotFoundError:
+                value = None
+        if value is None:
+            return None
+        self.skipped.append(step.name)
+        return value
+
+    # Function to forget a step that is about to run, so output it writes
+    # incrementally is never mistaken for a finished result if the run stops
+    def discard(self, step):
+        with _lock:
+            try:
+                with open(self.path, "r") as f:
+                    self.records.update(json.load(f))
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+            if self.records.pop(step.name, None) is not None:
+                atomic_write(self.path, json.dumps(self.records, indent=2))
+
+    # Function to write a completed step's value (to its output file, or as a
+    # draft in the state folder) and record the step. The record is persisted as
+    # soon as the value is on disk, so a failure later in the run does not lose it
+    # and a record never points at a value that was not written.
+    def record(self, step, fingerprint, value):
+        def commit():
+            with _lock:
+                # Merge with records written meanwhile by other runs for the same company
+                try:
+                    with open(self.path, "r") as f:
+                        self.records.update(json.load(f))
+                except (FileNotFoundError, json.JSONDecodeError):
+                    pass
+                self.records[step.name] = {"fingerprint": fingerprint, "output_hash": content_hash(value)}
+                atomic_write(self.path, json.dumps(self.records, indent=2))
+
+        path = step.output or self._value_path(step.name)
+        if self.store is None:
+            atomic_write(path, value)
+            commit()
+        else:
+            # Output files go into the artifact index; editor steps produce the final version
+            self.store.write(path, value, company_name=self.company_name if step.output else None,
+                             final=step.name.endswith("_final"), on_persisted=commit)
+        self.ran.append(step.name)
+
+
+# Function to open the run state kept for a company under processed/.steps
+def company_run_state(company_name):
+    return RunState(os.path.join("processed", ".steps", company_name), company_name, default_store())
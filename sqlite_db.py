@@ -0,0 +1,18 @@
+import sqlite3
+from contextlib import contextmanager
+
+
+# Function to open a short-lived connection for one operation, committed and
+# closed on exit. The databases are shared by the app, the job worker and batch
+# runs, so they use WAL and wait up to 30 s for another writer. Rows can be read
+# by column name or position.
+@contextmanager
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
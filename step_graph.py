@@ -0,0 +1,160 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from atomic_files import atomic_write
+
+# Upper bound on steps running at the same time, overridable per deployment
+MAX_WORKERS = int(os.environ.get("PIPELINE_MAX_WORKERS", "4"))
+
+
+# A unit of work in a pipeline run. `func` receives a dict holding the values of
+# the step's `inputs` (document texts or the outputs of other steps) and returns
+# the step's own value. When `output` is set the value is also written there.
+# `key` identifies the step's configuration (template, instructions) for run
+# fingerprints, and `force` makes it run even when its fingerprint matches.
+# Of the steps ready at the same time, those with a higher `priority` start
+# first; `profile` names the step_profiles.json profile its requests use.
+class Step:
+    def __init__(self, name, func, inputs=(), output=None, key="", force=False, priority=0, profile=None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.output = output
+        self.key = key
+        self.force = force
+        self.priority = priority
+        self.profile = profile
+
+    def __repr__(self):
+        return f"Step({self.name!r}, inputs={list(self.inputs)!r})"
+
+
+# Raised when a step fails; the original exception is chained as __cause__
+class StepError(Exception):
+    def __init__(self, step_name, error):
+        super().__init__(f"Step '{step_name}' failed: {error}")
+        self.step_name = step_name
+
+
+# Function to check that every input is either given or produced by a step, that
+# no two steps write the same output file, and that the steps form no cycle
+def check_steps(steps, available=()):
+    names = [step.name for step in steps]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate step names: {sorted(duplicates)}")
+
+    outputs = [os.path.abspath(step.output) for step in steps if step.output]
+    shared = {path for path in outputs if outputs.count(path) > 1}
+    if shared:
+        raise ValueError(f"Steps write the same output files: {sorted(shared)}")
+
+    known = set(available) | set(names)
+    for step in steps:
+        missing = [name for name in step.inputs if name not in known]
+        if missing:
+            raise ValueError(f"Step '{step.name}' needs unknown inputs: {missing}")
+
+    resolved = set(available)
+    remaining = list(steps)
+    while remaining:
+        ready = [step for step in remaining if all(name in resolved for name in step.inputs)]
+        if not ready:
+            raise ValueError(f"Steps form a cycle: {[step.name for step in remaining]}")
+        resolved.update(step.name for step in ready)
+        remaining = [step for step in remaining if step not in ready]
+
+
+# Function to keep the steps needed for `targets` (step names): the targets and,
+# transitively, every step whose value they read. Steps keep their order.
+def required_steps(steps, targets):
+    by_name = {step.name: step for step in steps}
+    unknown = [name for name in targets if name not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown steps: {unknown}")
+
+    needed = set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name in needed or name not in by_name:
+            continue
+        needed.add(name)
+        stack.extend(by_name[name].inputs)
+    return [step for step in steps if step.name in needed]
+
+
+# Function to list the inputs of `steps` that no step produces, which a run must be given
+def given_inputs(steps):
+    produced = {step.name for step in steps}
+    return list(dict.fromkeys(name for step in steps for name in step.inputs if name not in produced))
+
+
+# Function to run a list of steps, starting every step whose inputs are ready as
+# soon as possible, with at most `max_workers` steps running at once.
+# With a run_state.RunState, steps whose input fingerprint matches the last
+# successful run are skipped and their stored value reused. With a
+# metrics.RunMetrics, every step's timings and GPT usage are recorded in it.
+# Returns a dict of all values: the given ones plus every step's output.
+def run_steps(steps, values=None, max_workers=MAX_WORKERS, state=None, metrics=None):
+    values = dict(values or {})
+    check_steps(steps, values)
+
+    pending = list(steps)
+    running = {}
+    fingerprints = {}
+    failure = None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while pending or running:
+            # Start everything that is ready; stop scheduling new work after a failure.
+            # Reused steps can make others ready, so keep going until nothing changes.
+            while failure is None:
+                ready = [step for step in pending if all(name in values for name in step.inputs)]
+                if not ready:
+                    break
+                ready.sort(key=lambda step: -step.priority)
+                reused = False
+                for step in ready:
+                    pending.remove(step)
+                    step_values = {name: values[name] for name in step.inputs}
+                    if state is not None:
+                        fingerprints[step.name] = state.fingerprint(step, step_values)
+                        value = None if step.force else state.lookup(step, fingerprints[step.name])
+                        if value is not None:
+                            values[step.name] = value
+                            reused = True
+                            if metrics is not None:
+                                metrics.reused(step)
+                            continue
+                        state.discard(step)
+                    func = step.func if metrics is None else metrics.step(step)
+                    running[executor.submit(func, step_values)] = step
+                if not reused:
+                    break
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    # Let the steps already in flight finish so their outputs are kept
+                    if failure is None:
+                        failure = (step, e)
+                    continue
+                values[step.name] = value
+                if state is not None:
+                    # The run state writes the output along with its record
+                    state.record(step, fingerprints[step.name], value)
+                elif step.output:
+                    # Replaced atomically, so overlapping runs never leave a torn file
+                    atomic_write(step.output, value)
+
+    if failure is not None:
+        step, error = failure
+        raise StepError(step.name, error) from error
+    return values
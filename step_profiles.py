@@ -0,0 +1,59 @@
+import json
+import os
+
+from gpt_client import DEFAULT_MAX_TOKENS, DEFAULT_MODEL
+
+PROFILES_FILE = "step_profiles.json"
+
+# Used for anything step_profiles.json leaves out
+DEFAULT_PROFILE = {
+    "model": DEFAULT_MODEL,
+    "max_tokens": DEFAULT_MAX_TOKENS,
+    "temperature": None,
+    "timeout": 120,
+    "priority": 0,
+}
+
+# Profile fields passed on to GPTTransport.complete; "priority" orders ready steps instead
+REQUEST_FIELDS = ("model", "max_tokens", "temperature", "timeout")
+
+
+# Execution profiles of GPT steps: model, max_tokens, temperature, timeout and
+# priority. A step's profile is the one named for the step itself in "steps",
+# else the one named for its prompts.json template in "prompts", else "default".
+# Named profiles only list what they change from "default".
+class StepProfiles:
+    def __init__(self, config=None):
+        config = config or {}
+        self.default = {**DEFAULT_PROFILE, **config.get("default", {})}
+        self.profiles = {"default": self.default}
+        for name, fields in config.get("profiles", {}).items():
+            unknown = set(fields) - set(DEFAULT_PROFILE)
+            if unknown:
+                raise ValueError(f"Profile '{name}' has unknown fields: {sorted(unknown)}")
+            self.profiles[name] = {**self.default, **fields}
+        self.prompts = config.get("prompts", {})
+        self.steps = config.get("steps", {})
+        for key, name in {**self.prompts, **self.steps}.items():
+            if name not in self.profiles:
+                raise ValueError(f"'{key}' uses unknown profile '{name}'")
+
+    # Function to return the name of a step's profile
+    def name(self, step_name, prompt_key=None):
+        return self.steps.get(step_name) or self.prompts.get(prompt_key) or "default"
+
+    def profile(self, step_name, prompt_key=None):
+        return self.profiles[self.name(step_name, prompt_key)]
+
+    # Function to return the keyword arguments a step's requests are sent with
+    def request(self, step_name, prompt_key=None):
+        profile = self.profile(step_name, prompt_key)
+        return {field: profile[field] for field in REQUEST_FIELDS if profile[field] is not None}
+
+
+# Function to load the step profiles; without the file every step gets DEFAULT_PROFILE
+def load_step_profiles(path=PROFILES_FILE):
+    if not os.path.exists(path):
+        return StepProfiles()
+    with open(path, "r") as f:
+        return StepProfiles(json.load(f))